@@ -0,0 +1,142 @@
+import os
+import io
+import sys
+import json
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+from clones import run_clone
+
+# runs a manifest of machines without a terminal, several at a time, and
+# prints a json line for each as it finishes. a manifest has a json object per
+# line, describing one machine:
+#
+#   {
+#       "name": "boots",                     (defaults to the line number)
+#       "bios": "bin/bios",                  (defaults to the usual bios)
+#       "devices": ["0=boot:bin/testos"],
+#       "args": ["--virtual-time"],          (any other options for main.py)
+#       "script": "\u001b00\n",              (typed into the console)
+#       "cycles": 5000000,                   (and/or "instructions")
+#       "seconds": 10,                       (defaults to --seconds)
+#       "expect": "Hello, world!"            (should appear in the output)
+#   }
+#
+# blank lines and lines starting with # are skipped. paths are relative to the
+# manifest. each machine's serial ports are connected to memory, and its disks
+# are private to it, so that machines using the same image don't see each
+# other's writes.
+
+def machine_argv(config: dict) -> list[str]:
+    argv = []
+    if "bios" in config: argv += ["--bios", config["bios"]]
+    for device in config.get("devices", []): argv += ["--device", device]
+    return argv + config.get("args", [])
+
+def invalid(name: str, error: str) -> dict:
+    return {"name": name, "reason": "invalid", "error": error, "cycles": 0,
+            "seconds": 0.0}
+
+def run_config(config: dict, seconds: float) -> dict:
+    result = {"name": config["name"]}
+    usage = io.StringIO()
+    try:
+        # argparse prints why it gave up, so that goes in the result too
+        with contextlib.redirect_stderr(usage):
+            args = main.parse_args(machine_argv(config))
+        # the console is left on stdio (which isn't touched until it is
+        # attached), since it's swapped for memory before running
+        cpu = main.create_machine(args)
+    except SystemExit:
+        lines = usage.getvalue().strip().splitlines()
+        return invalid(config["name"], lines[-1] if lines else "bad options")
+    except (OSError, ValueError) as e:
+        # e.g. a disk image that doesn't exist
+        return invalid(config["name"], str(e))
+
+    run = run_clone(cpu, config.get("script", "").encode("latin-1"),
+                    config.get("cycles"), config.get("seconds", seconds),
+                    config.get("instructions"))
+    output = run["output"].decode("latin-1")
+    result.update(reason=run["reason"], cycles=run["cycles"],
+                  seconds=round(run["seconds"], 6))
+    if "expect" in config: result["passed"] = config["expect"] in output
+    result["output"] = output
+    return result
+
+def read_manifest(path: str) -> tuple[list[dict], list[dict]]:
+    # the configs in a manifest, and invalid results for lines that aren't
+    # configs
+    configs = []
+    bad = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"): continue
+            try:
+                config = json.loads(line)
+            except ValueError as e:
+                bad.append(invalid(str(number), f"not json: {e}"))
+                continue
+            if not isinstance(config, dict):
+                bad.append(invalid(str(number), "not a json object"))
+                continue
+            config.setdefault("name", str(number))
+            configs.append(config)
+    return configs, bad
+
+def main_batch() -> None:
+    parser = argparse.ArgumentParser(
+        prog="ozpex-128-batch",
+        description="run a manifest of ozpex 128 machines without a "
+                    "terminal, printing a json line with the result of each",
+    )
+    parser.add_argument("manifest",
+                        help="a file with a json object per line, for each "
+                             "machine (see batch.py)")
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="how many machines to run at once (default: "
+                             "one per core)")
+    parser.add_argument("--seconds",
+                        type=float,
+                        default=60,
+                        help="the time limit for machines that don't give "
+                             "one (default: 60)")
+    args = parser.parse_args()
+
+    try:
+        configs, bad = read_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"\033[31memu: cannot read the manifest: {e}.\033[0m",
+              file=sys.stderr)
+        exit(1)
+
+    # every machine is run from the manifest's directory, so that its paths
+    # work out
+    directory = os.path.dirname(os.path.abspath(args.manifest))
+    for result in bad: print(json.dumps(result), flush=True)
+    failed = bool(bad)
+    with ProcessPoolExecutor(args.jobs, initializer=os.chdir,
+                             initargs=(directory,)) as pool:
+        runs = {pool.submit(run_config, config, args.seconds): config
+                for config in configs}
+        for run in as_completed(runs):
+            try:
+                result = run.result()
+            except Exception as e:
+                # one run going wrong shouldn't lose the others' results
+                result = {"name": runs[run]["name"], "reason": "error",
+                          "error": repr(e), "cycles": 0, "seconds": 0.0}
+            if result["reason"] in ("invalid", "error") or \
+                result["reason"].startswith("crashed") or \
+                result.get("passed") is False:
+                failed = True
+            print(json.dumps(result), flush=True)
+
+    if failed: exit(1)
+
+if __name__ == "__main__":
+    main_batch()
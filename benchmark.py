@@ -0,0 +1,68 @@
+import time
+import argparse
+
+from components.cpu import Cpu
+from components.ram import Ram
+from components.rom import Rom
+
+# copies a page of memory while summing it, forever
+PROGRAM = [
+    0xa2, 0x00,       # $0200: ldx #0
+    0xbd, 0x00, 0x03, # $0202: lda $0300,x
+    0x9d, 0x00, 0x04, # $0205: sta $0400,x
+    0x65, 0x10,       # $0208: adc $10
+    0x85, 0x10,       # $020a: sta $10
+    0xe8,             # $020c: inx
+    0xd0, 0xf3,       # $020d: bne $0202
+    0x4c, 0x00, 0x02, # $020f: jmp $0200
+]
+
+def create_machine() -> Cpu:
+    cpu = Cpu({
+        "ram": Ram(0x0000, 0xbfff),
+        "rom": Rom(0xe000, 0xffff),
+    })
+    cpu.mm_components["ram"].load(PROGRAM, 0x0200)
+    cpu.carry = False
+    cpu.decimal = False
+    cpu.pc = 0x0200
+    return cpu
+
+def measure(name: str, cpu: Cpu, step, instructions: int) -> float:
+    # `step` runs at least this many instructions, and returns how many it
+    # actually ran (a translated block can overshoot)
+    start = time.perf_counter()
+    executed = step(instructions)
+    elapsed = time.perf_counter() - start
+    mips = executed / elapsed / 1_000_000
+    mhz = cpu.cycles / elapsed / 1_000_000
+    print(f"{name:12} {mips:6.2f}M instructions/s {mhz:6.2f}MHz")
+    return mips
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="measure the speed of each of the emulator's execution "
+                    "paths",
+    )
+    parser.add_argument("-n", "--instructions", type=int, default=500_000)
+    args = parser.parse_args()
+
+    cpu = create_machine()
+    def interpret(count: int) -> int:
+        for _ in range(count): cpu.interpret()
+        return count
+    base = measure("interpret", cpu, interpret, args.instructions)
+
+    cpu = create_machine()
+    def execute(count: int) -> int:
+        for _ in range(count): cpu.execute()
+        return count
+    fast = measure("execute", cpu, execute, args.instructions)
+    print(f"{'':12} {fast / base:6.2f}x")
+
+    cpu = create_machine()
+    fast = measure("run", cpu, cpu.run, args.instructions)
+    print(f"{'':12} {fast / base:6.2f}x")
+
+if __name__ == "__main__":
+    main()
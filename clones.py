@@ -0,0 +1,176 @@
+import os
+import gc
+import time
+import pickle
+import selectors
+from collections.abc import Iterator
+
+from components.cpu import Cpu
+from components.idle import Stalled, OutOfTime
+from components.serial import SerialPort
+from components.transports import MemoryTransport
+from components.block_devices import BlockDeviceInterface
+
+# a machine that has already booted can be cloned into many forked processes,
+# which share its memory copy-on-write, so booting is only paid for once. each
+# clone gets its own input script on the console, and runs until it hits a
+# limit, crashes or stalls (e.g. waiting for input after its script has run
+# out), and what it printed comes back over a pipe.
+
+SLICE_CYCLES = 100_000
+SLICE_INSTRUCTIONS = 25_000
+
+def run_headless(cpu: Cpu, cycles: int | None,
+                 seconds: float | None = None,
+                 instructions: int | None = None) -> tuple[str, int, float]:
+    # run for this many cycles and/or instructions (each at least, and None
+    # for no limit), or until `seconds` have passed, or the guest crashes or
+    # stalls. returns why it stopped ("cycles", "instructions", "time",
+    # "stalled" or "crashed: ..."), and the cycles and seconds it ran for.
+    cpu.idle.stop_when_stalled = True
+
+    start_cycles = cpu.cycles
+    start = time.perf_counter()
+    if seconds is not None: cpu.idle.deadline = start + seconds
+    executed = 0
+    try:
+        while True:
+            ran = cpu.cycles - start_cycles
+            if cycles is not None and ran >= cycles:
+                reason = "cycles"
+                break
+            if instructions is not None and executed >= instructions:
+                reason = "instructions"
+                break
+            if seconds is not None and time.perf_counter() - start >= seconds:
+                reason = "time"
+                break
+
+            if instructions is not None:
+                executed += cpu.run(min(SLICE_INSTRUCTIONS,
+                                        instructions - executed))
+            elif cycles is not None:
+                cpu.run_cycles(min(SLICE_CYCLES, cycles - ran))
+            else:
+                cpu.run_cycles(SLICE_CYCLES)
+    except Stalled:
+        reason = "stalled"
+    except OutOfTime:
+        reason = "time"
+    except (NotImplementedError, IndexError) as e:
+        reason = f"crashed: {e}"
+    finally:
+        cpu.idle.deadline = None
+
+    for c in cpu.mm_components.values():
+        if isinstance(c, SerialPort): c.flush()
+    return reason, cpu.cycles - start_cycles, time.perf_counter() - start
+
+def isolate(cpu: Cpu, script: bytes) -> MemoryTransport:
+    # cut a forked machine off from everything it shares with its parent: the
+    # serial ports are connected to memory, and disks are copied. returns the
+    # console's transport.
+    console = None
+    for c in cpu.mm_components.values():
+        if isinstance(c, SerialPort):
+            c.output.clear()
+            c.transport = MemoryTransport(script if c.console else b"")
+            if c.console and console is None: console = c.transport
+        elif isinstance(c, BlockDeviceInterface):
+            for device in c.devices:
+                if device is not None: device.make_private()
+    return MemoryTransport() if console is None else console
+
+def run_clone(cpu: Cpu, script: bytes, cycles: int | None,
+              seconds: float | None, instructions: int | None = None) -> dict:
+    console = isolate(cpu, script)
+    reason, ran, elapsed = run_headless(cpu, cycles, seconds, instructions)
+    return {
+        "reason": reason,
+        "cycles": ran,
+        "seconds": elapsed,
+        "output": bytes(console.output),
+    }
+
+def clone(cpu: Cpu, scripts: list[bytes], cycles: int,
+          seconds: float | None = None,
+          workers: int | None = None) -> Iterator[tuple[int, dict]]:
+    """
+    Run a clone of `cpu` for each input script, with up to `workers` (every
+    core by default) running at once, each in a forked process (linux & mac
+    only). The machine itself is left as it was.
+
+    Yields (index of the script, result) as each clone finishes, in whatever
+    order they finish. A result is a dict of why the clone stopped (see
+    `run_headless`), the cycles and seconds it ran for, and its console
+    `output`. A clone that raised stops with "error", and the exception is
+    in its `error`.
+    """
+
+    workers = workers or os.cpu_count() or 1
+    pending = list(enumerate(scripts))
+    # pipe -> (script index, pid, what has been read so far)
+    running: dict[int, tuple[int, int, list[bytes]]] = {}
+    selector = selectors.DefaultSelector()
+
+    # anything still buffered would otherwise be sent by every clone too
+    for c in cpu.mm_components.values():
+        if isinstance(c, SerialPort): c.flush()
+    # objects that exist now are never collected in the clones, so the
+    # collector doesn't copy every page it looks at
+    gc.freeze()
+
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                index, script = pending.pop(0)
+                read_fd, write_fd = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    os.close(read_fd)
+                    status = 1
+                    try:
+                        try:
+                            result = run_clone(cpu, script, cycles, seconds)
+                            status = 0
+                        except Exception as e:
+                            # reported rather than lost with the clone
+                            result = {"reason": "error",
+                                      "error": f"{type(e).__name__}: {e}",
+                                      "cycles": 0, "seconds": 0.0,
+                                      "output": b""}
+                        with os.fdopen(write_fd, "wb") as pipe:
+                            pipe.write(pickle.dumps(result))
+                    finally:
+                        # skip the parent's exit handlers and buffers
+                        os._exit(status)
+
+                os.close(write_fd)
+                running[read_fd] = (index, pid, [])
+                selector.register(read_fd, selectors.EVENT_READ)
+
+            for key, _ in selector.select():
+                fd = key.fd
+                index, pid, chunks = running[fd]
+                data = os.read(fd, 65536)
+                if data:
+                    chunks.append(data)
+                    continue
+
+                selector.unregister(fd)
+                os.close(fd)
+                del running[fd]
+                os.waitpid(pid, 0)
+
+                if chunks:
+                    yield index, pickle.loads(b"".join(chunks))
+                else:
+                    yield index, {"reason": "lost", "cycles": 0,
+                                  "seconds": 0.0, "output": b""}
+    finally:
+        for fd, (_, pid, _) in running.items():
+            os.close(fd)
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+        selector.close()
+        gc.unfreeze()
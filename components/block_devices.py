@@ -1,5 +1,7 @@
+import os
+import mmap
+import struct
 from abc import ABC, abstractmethod
-from typing import Annotated
 from random import randint
 
 from components.mm_component import MemoryMappedComponent
@@ -17,49 +19,404 @@ class BlockDevice(ABC):
     @abstractmethod
     def write(self, sector: int, addr: int, val: int) -> None: pass
     @abstractmethod
-    def status(self) -> int: pass
+    def status(self, now: int) -> int: pass
+    
+    def seek(self, sector: int, now: int) -> None:
+        # called whenever the sector byte is written to (`now` is the cpu's
+        # cycle count), even if the sector doesn't change
+        pass
+    
+    def select(self, sector: int) -> None:
+        # called when the device is switched to, with the current sector.
+        # switching devices never makes one busy.
+        pass
+    
+    # whole sectors at a time, for the host rather than the cpu. devices
+    # should override these, since the defaults go a byte at a time.
+    def read_sector(self, sector: int) -> memoryview:
+        # the latest contents of a sector, which may be a view into the
+        # device, so it should be copied if it has to be kept
+        return memoryview(bytes(self.fetch(sector, i) for i in range(256)))
+    
+    def write_sector(self, sector: int, data: bytes) -> None:
+        for i, val in enumerate(data[:256]):
+            self.write(sector, i, val)
+            
+    # the device's state for a snapshot, which is every sector by default
+    def save_state(self) -> bytes:
+        return b"".join(bytes(self.read_sector(s)) for s in range(256))
+    
+    def load_state(self, data: memoryview) -> None:
+        for sector in range(256):
+            self.write_sector(sector, data[sector * 256:(sector + 1) * 256])
+
+    def make_private(self) -> None:
+        # stop sharing storage with other processes, so that a forked copy of
+        # the machine keeps its writes to itself
+        pass
 
 class SectoredStorage(BlockDevice):
-    def __init__(self, data: Annotated[bytearray, 65536], bootable: bool):
+    """
+    SectoredStorage is a disk holding 256 sectors of 256 bytes each.
+    
+    The cpu never accesses the disk directly, only a 256 byte buffer. Writing
+    the sector byte copies the buffer back to the disk (if it was changed),
+    and then fills it with the new sector. Afterwards, the device is busy for
+    `busy_cycles` cycles, which is 0 for a disk that is never busy.
+    
+    Sectors past the end of the disk image read as random bytes, and writes
+    to them are lost.
+    """
+    
+    # sector, modified, busy until, followed by the buffer and every sector
+    STATE = struct.Struct("<BBQ")
+    
+    def __init__(self, data: bytearray, bootable: bool,
+                 busy_cycles: int = 0):
         self.data = data
         self.standard_api = SECTORED_STORAGE
         self.bootable = bootable
         
+        self.busy_cycles = busy_cycles
+        self.busy_until = 0
+        
+        self.sector = 0
+        self.buffer = bytearray(256)
+        self.modified = False
+        self.load(0)
+        
+    def stored(self, sector: int) -> memoryview:
+        # a sector on the disk itself, which is cut short past the end of the
+        # image
+        return memoryview(self.data)[sector * 256:(sector + 1) * 256]
+    
+    def save(self, sector: int, data: bytes) -> None:
+        start = sector * 256
+        size = min(256, len(self.data) - start, len(data))
+        if size <= 0: return
+        self.data[start:start + size] = data[:size]
+        
+        # only a mapped image file has somewhere to write back to. msync only
+        # takes offsets on a page boundary.
+        if isinstance(self.data, mmap.mmap) and not self.data.closed:
+            page = start // mmap.ALLOCATIONGRANULARITY * \
+                mmap.ALLOCATIONGRANULARITY
+            self.data.flush(page, start + size - page)
+    
+    def load(self, sector: int) -> None:
+        chunk = self.stored(sector)
+        self.buffer[:len(chunk)] = chunk
+        if len(chunk) < 256:
+            self.buffer[len(chunk):] = os.urandom(256 - len(chunk))
+        self.sector = sector
+        self.modified = False
+        
+    def store(self) -> None:
+        self.save(self.sector, self.buffer)
+        
+    def read_sector(self, sector: int) -> memoryview:
+        if sector == self.sector and self.modified:
+            return memoryview(self.buffer)
+        return self.stored(sector)
+    
+    def write_sector(self, sector: int, data: bytes) -> None:
+        self.save(sector, data)
+        # the host's write wins over any changes in the buffer
+        if sector == self.sector: self.load(sector)
+        
     def fetch(self, sector: int, addr: int) -> int:
-        try:
-            return self.data[sector * 256 + addr]
-        except IndexError:
-            return randint(0x00, 0xff)
+        return self.buffer[addr]
     
     def write(self, sector: int, addr: int, val: int) -> None:
-        try:
-            self.data[sector * 256 + addr] = val
-        except IndexError:
-            pass
+        self.buffer[addr] = val
+        self.modified = True
+        
+    def seek(self, sector: int, now: int) -> None:
+        if self.modified: self.store()
+        self.load(sector)
+        self.busy_until = now + self.busy_cycles
+    
+    def select(self, sector: int) -> None:
+        # bring the buffer up to the sector, without the wait of a seek
+        if sector == self.sector: return
+        if self.modified: self.store()
+        self.load(sector)
         
-    def status(self) -> int:
+    def status(self, now: int) -> int:
         status = self.standard_api
         
         if self.bootable: status |= IS_BOOTABLE
+        if now < self.busy_until: status |= IS_BUSY
         
         return status
     
+    def make_private(self) -> None:
+        # a mapped image file is shared with every process forked from this
+        # one, and with the file itself
+        if isinstance(self.data, mmap.mmap): self.data = bytearray(self.data)
+    
+    def save_state(self) -> bytes:
+        image = bytearray(256 * 256)
+        for sector in range(256):
+            chunk = self.stored(sector)
+            image[sector * 256:sector * 256 + len(chunk)] = chunk
+        return self.STATE.pack(self.sector, self.modified, self.busy_until) + \
+            self.buffer + image
+    
+    def load_state(self, data: memoryview) -> None:
+        # only sectors that differ are written back, as far as the image goes
+        image = self.saved_image(data)
+        for sector in range(256):
+            stored = self.stored(sector)
+            chunk = image[sector * 256:sector * 256 + len(stored)]
+            if stored != chunk: self.save(sector, chunk)
+        self.load_buffer(data)
+        
+    def saved_image(self, data: memoryview) -> memoryview:
+        start = self.STATE.size + 256
+        return data[start:start + 256 * 256]
+        
+    def load_buffer(self, data: memoryview) -> None:
+        sector, modified, self.busy_until = self.STATE.unpack_from(data)
+        self.buffer[:] = data[self.STATE.size:self.STATE.size + 256]
+        self.sector = sector
+        self.modified = bool(modified)
+    
+def map_image(path: str) -> mmap.mmap | bytearray:
+    # disk images are mapped into memory rather than read, so nothing is
+    # copied up front and writes go straight back to the file. images that
+    # can't be written to are mapped copy-on-write, so writes only last until
+    # the emulator exits.
+    try:
+        f = open(path, "r+b")
+        access = mmap.ACCESS_WRITE
+    except PermissionError:
+        f = open(path, "rb")
+        access = mmap.ACCESS_COPY
+    
+    with f:
+        # empty files can't be mapped
+        if os.fstat(f.fileno()).st_size == 0: return bytearray()
+        return mmap.mmap(f.fileno(), 0, access=access)
+
 class BootableDrive(SectoredStorage):
-    def __init__(self, path: str):
-        with open(path, "rb") as f:
-            super().__init__(f.read(), bootable=True)
+    def __init__(self, path: str, busy_cycles: int = 0):
+        super().__init__(map_image(path), bootable=True,
+                         busy_cycles=busy_cycles)
         
 class NonBootableDrive(SectoredStorage):
-    def __init__(self, path: str):
+    def __init__(self, path: str, busy_cycles: int = 0):
+        super().__init__(map_image(path), bootable=False,
+                         busy_cycles=busy_cycles)
+
+# base images of copy-on-write disks, shared by every disk using them.
+# realpath -> read-only mapping
+shared_images: dict[str, mmap.mmap | bytes] = {}
+
+def shared_image(path: str) -> mmap.mmap | bytes:
+    path = os.path.realpath(path)
+    if path not in shared_images:
         with open(path, "rb") as f:
-            super().__init__(f.read(), bootable=False)
+            if os.fstat(f.fileno()).st_size == 0:
+                shared_images[path] = bytes()
+            else:
+                shared_images[path] = mmap.mmap(f.fileno(), 0,
+                                                access=mmap.ACCESS_READ)
+    return shared_images[path]
+
+# an overlay file starts with a byte per sector, which is 1 if the sector is
+# in the overlay, followed by all 256 sectors. sectors that were never written
+# are left as holes, so the file takes up little more space than its sectors.
+OVERLAY_HEADER = 256
+OVERLAY_SIZE = OVERLAY_HEADER + 256 * 256
+
+def map_overlay(path: str, create: bool = True) -> mmap.mmap:
+    # unless `create` is set, the overlay file has to exist already
+    with open(path, "a+b" if create else "r+b") as f:
+        if os.fstat(f.fileno()).st_size < OVERLAY_SIZE:
+            if not create: raise ValueError(f"'{path}' is not an overlay")
+            f.truncate(OVERLAY_SIZE)
+        return mmap.mmap(f.fileno(), OVERLAY_SIZE, access=mmap.ACCESS_WRITE)
 
-class ExtendedRAM(SectoredStorage):
-    def __init__(self, _) -> None:
-        # this sounds like a strange thing to inherit from, but it makes sense
-        # if you think about it
-        super().__init__(bytearray(65536), bootable=False)
+class CopyOnWriteDrive(SectoredStorage):
+    """
+    A CopyOnWriteDrive is a bootable disk that never changes its image.
+    
+    Every copy-on-write disk on the same base image shares one read-only
+    mapping of it. Sectors written back from the buffer are kept in an
+    overlay instead, which is in memory unless an overlay file is given, so
+    that they can outlive the emulator.
+    
+    `commit` copies the overlay into the base image, and `discard` throws it
+    away, returning the disk to how the base image left it. An overlay file
+    is created if it doesn't exist, unless `create_overlay` is False.
+    """
+    
+    def __init__(self, arg: str, busy_cycles: int = 0,
+                 create_overlay: bool = True) -> None:
+        # <base>[:<overlay>]
+        base, _, overlay = arg.partition(":")
+        self.base_path = base
+        
+        # sector -> contents, for overlays in memory
+        self.sectors: dict[int, bytes] = {}
+        self.overlay = map_overlay(overlay, create_overlay) if overlay \
+            else None
+        
+        super().__init__(shared_image(base), bootable=True,
+                         busy_cycles=busy_cycles)
+        
+    def in_overlay(self, sector: int) -> bool:
+        if self.overlay is None: return sector in self.sectors
+        return self.overlay[sector] != 0
+        
+    def stored(self, sector: int) -> memoryview:
+        if not self.in_overlay(sector): return super().stored(sector)
+        if self.overlay is None: return memoryview(self.sectors[sector])
+        
+        start = OVERLAY_HEADER + sector * 256
+        return memoryview(self.overlay)[start:start + 256]
+        
+    def save(self, sector: int, data: bytes) -> None:
+        # sectors in the overlay are always whole
+        sector_data = bytearray(self.stored(sector))
+        sector_data[len(sector_data):] = os.urandom(256 - len(sector_data))
+        sector_data[:len(data)] = data[:256]
+        
+        if self.overlay is None:
+            self.sectors[sector] = bytes(sector_data)
+            return
+        
+        start = OVERLAY_HEADER + sector * 256
+        self.overlay[start:start + 256] = sector_data
+        self.overlay[sector] = 1
+        page = start // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+        self.overlay.flush(page, start + 256 - page)
+        self.overlay.flush(0, OVERLAY_HEADER)
+        
+    def commit(self) -> None:
+        # write every sector in the overlay into the base image, then empty
+        # the overlay. writes past the end of the image are lost, as usual.
+        if self.modified: self.store()
+        
+        with open(self.base_path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            for sector in range(256):
+                if not self.in_overlay(sector) or sector * 256 >= size:
+                    continue
+                f.seek(sector * 256)
+                f.write(self.stored(sector)[:size - sector * 256])
+        
+        self.discard()
+        
+    def make_private(self) -> None:
+        # the base image is never written to, but an overlay file is, so its
+        # sectors are moved into memory
+        if self.overlay is None: return
+        for sector in range(256):
+            if self.in_overlay(sector):
+                self.sectors[sector] = bytes(self.stored(sector))
+        self.overlay = None
+        
+    def drop(self, sector: int) -> None:
+        # take a sector out of the overlay, back to the base image's contents
+        if self.overlay is None:
+            self.sectors.pop(sector, None)
+            return
+        self.overlay[sector] = 0
+        self.overlay.flush(0, OVERLAY_HEADER)
+        
+    def save_state(self) -> bytes:
+        # followed by which sectors are in the overlay
+        return super().save_state() + \
+            bytes(self.in_overlay(s) for s in range(256))
+    
+    def load_state(self, data: memoryview) -> None:
+        overlaid = data[-256:]
+        image = self.saved_image(data)
+        for sector in range(256):
+            chunk = image[sector * 256:(sector + 1) * 256]
+            if not overlaid[sector]:
+                if self.in_overlay(sector): self.drop(sector)
+            elif not self.in_overlay(sector) or self.stored(sector) != chunk:
+                self.save(sector, chunk)
+        self.load_buffer(data)
+        
+    def discard(self) -> None:
+        self.sectors.clear()
+        if self.overlay is not None:
+            self.overlay[:OVERLAY_HEADER] = bytes(OVERLAY_HEADER)
+            self.overlay.flush(0, OVERLAY_HEADER)
+        self.load(self.sector)
+
+class ExtendedRAM(BlockDevice):
+    """
+    ExtendedRAM adds 64K of memory, seen through a 256 byte window onto the
+    selected sector. Unlike sectored storage, the window is directly into the
+    ram chip rather than a buffer, so it is never busy.
+    
+    Each sector is only allocated once something other than the fill value
+    is written to it, and reads as the fill value until then. The fill value
+    can be given as the device's argument (e.g. `xmem:0xff`), and is 0 by
+    default.
+    """
+    
+    def __init__(self, fill: str = "", busy_cycles: int = 0) -> None:
         self.standard_api = EXTENDED_MEMORY
+        try:
+            self.fill = int(fill, 0) if fill else 0
+        except ValueError:
+            self.fill = -1
+        if not 0 <= self.fill <= 0xff:
+            raise ValueError(f"'{fill}' is not a fill value, it should be a "
+                             f"byte like 0xff")
+        
+        self.pages: list[bytearray | None] = [None] * 256
+        
+    def fetch(self, sector: int, addr: int) -> int:
+        page = self.pages[sector]
+        return self.fill if page is None else page[addr]
+    
+    def write(self, sector: int, addr: int, val: int) -> None:
+        page = self.pages[sector]
+        if page is None:
+            if val == self.fill: return
+            page = self.pages[sector] = bytearray([self.fill]) * 256
+        page[addr] = val
+        
+    def status(self, now: int) -> int:
+        return self.standard_api
+    
+    def read_sector(self, sector: int) -> memoryview:
+        page = self.pages[sector]
+        if page is None: return memoryview(bytes([self.fill]) * 256)
+        return memoryview(page)
+    
+    def write_sector(self, sector: int, data: bytes) -> None:
+        data = bytes(data[:256])
+        page = self.pages[sector]
+        if page is None:
+            if data.count(self.fill) == len(data): return
+            page = self.pages[sector] = bytearray([self.fill]) * 256
+        page[:len(data)] = data
+    
+    def resident_pages(self) -> int:
+        # how many sectors have actually been allocated
+        return sum(page is not None for page in self.pages)
+    
+    def save_state(self) -> bytes:
+        # which sectors are allocated, followed by each allocated sector
+        return bytes(page is not None for page in self.pages) + \
+            b"".join(page for page in self.pages if page is not None)
+    
+    def load_state(self, data: memoryview) -> None:
+        offset = 256
+        for sector in range(256):
+            if not data[sector]:
+                self.pages[sector] = None
+                continue
+            self.pages[sector] = bytearray(data[offset:offset + 256])
+            offset += 256
 
 class BlockDeviceInterface(MemoryMappedComponent):
     def __init__(self, sector: int, status: int, selector: int, readout: int) -> None:
@@ -73,6 +430,45 @@ class BlockDeviceInterface(MemoryMappedComponent):
         self.readout_start = readout
         self.devices: list[BlockDevice|None] = [None] * 256
         
+        self.cpu = None
+        
+    def attach(self, cpu) -> None:
+        # the cycle count is needed to time busy devices
+        self.cpu = cpu
+        
+    def now(self) -> int:
+        return 0 if self.cpu is None else self.cpu.cycles
+        
+    def save_state(self) -> dict[str, bytes]:
+        # a section per device, named after its slot, starting with the name
+        # of its type
+        sections = {"": bytes([self.sector, self.selected])}
+        for slot, device in enumerate(self.devices):
+            if device is None: continue
+            sections[str(slot)] = type(device).__name__.encode() + b"\0" + \
+                device.save_state()
+        return sections
+    
+    def load_state(self, sections: dict[str, memoryview]) -> None:
+        self.sector, self.selected = sections[""]
+        for slot, device in enumerate(self.devices):
+            data = sections.get(str(slot))
+            kind = None if device is None else type(device).__name__
+            
+            if data is None:
+                if device is None: continue
+                raise ValueError(f"slot {slot} was empty in the snapshot, but "
+                                 f"holds a {kind}")
+            
+            saved_kind = bytes(data[:64]).partition(b"\0")[0].decode()
+            if device is None:
+                raise ValueError(f"slot {slot} held a {saved_kind} in the "
+                                 f"snapshot, but is empty")
+            if saved_kind != kind:
+                raise ValueError(f"slot {slot} held a {saved_kind} in the "
+                                 f"snapshot, but holds a {kind}")
+            device.load_state(data[len(saved_kind) + 1:])
+    
     def device_fetch(self, addr: int) -> int:
         byte = addr - self.readout_start
         return self.devices[self.selected].fetch(self.sector, byte)
@@ -81,9 +477,17 @@ class BlockDeviceInterface(MemoryMappedComponent):
         return self.devices[self.selected].write(self.sector, byte, val)
         
     def contains(self, addr: int) -> bool:
-        return addr in [self.sector_addr, self.status_addr, self.selector_addr] or \
+        return addr in (self.sector_addr, self.status_addr, self.selector_addr) or \
             (self.readout_start <= addr <= self.readout_start + 0xff)
     
+    def address_ranges(self) -> list[tuple[int, int]]:
+        return [
+            (self.sector_addr, self.sector_addr),
+            (self.status_addr, self.status_addr),
+            (self.selector_addr, self.selector_addr),
+            (self.readout_start, self.readout_start + 0xff),
+        ]
+    
     def fetch(self, addr: int) -> int:
         if addr == self.sector_addr:
             return self.sector
@@ -93,7 +497,7 @@ class BlockDeviceInterface(MemoryMappedComponent):
         
         if addr == self.status_addr:
             if self.devices[self.selected] is None: return 0b00000000
-            return self.devices[self.selected].status()
+            return self.devices[self.selected].status(self.now())
         
         if self.devices[self.selected] is None:
             return randint(0x00, 0x0ff) # simulating floating pins or something
@@ -106,10 +510,17 @@ class BlockDeviceInterface(MemoryMappedComponent):
             return
         
         if addr == self.selector_addr:
+            # the newly selected device's buffer is moved to the current
+            # sector, so that it isn't left on whatever it was last at
             self.selected = val
+            device = self.devices[val]
+            if device is not None: device.select(self.sector)
             return
         
         if addr == self.sector_addr:
+            # writing the sector byte flushes, even if it doesn't change
+            device = self.devices[self.selected]
+            if device is not None: device.seek(val, self.now())
             self.sector = val
             return
         
@@ -0,0 +1,72 @@
+import re
+import time
+
+UNITS = {"": 1, "hz": 1, "khz": 1_000, "mhz": 1_000_000, "ghz": 1_000_000_000}
+
+def parse_clock(text: str) -> int | None:
+    """
+    Parse a clock rate like '1MHz', '500khz' or '2000000' into Hz. 'unlimited'
+    (or 'turbo') gives None, meaning the cpu should never be slowed down.
+    """
+    text = text.strip().lower()
+    if text in ("unlimited", "turbo"): return None
+
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([kmg]?hz)?", text)
+    if match is None:
+        raise ValueError(f"'{text}' is not a clock rate")
+
+    hz = int(float(match.group(1)) * UNITS[match.group(2) or ""])
+    if hz <= 0: raise ValueError("the clock rate must be positive")
+    return hz
+
+class Clock:
+    """
+    The Clock paces the cpu to a target clock rate.
+
+    The cpu runs in short time slices. After each slice, the clock compares
+    the cycles executed against the time elapsed on `time.perf_counter_ns`,
+    and sleeps off whatever is left of the slice. Since the target time is
+    always measured from the start, oversleeping in one slice is made up for
+    in the next, so the rate stays stable even with a coarse `time.sleep`.
+
+    If the cpu falls too far behind (a slow host, or the process was paused),
+    the clock starts counting again from now instead of racing to catch up.
+    """
+
+    SLICE_NS = 10_000_000   # 10ms
+    MAX_DRIFT_NS = 100_000_000
+    TURBO_SLICE = 100_000 # cycles per slice when unlimited
+
+    def __init__(self, hz: int | None) -> None:
+        self.hz = hz
+
+        if hz is None:
+            self.slice_cycles = self.TURBO_SLICE
+        else:
+            self.slice_cycles = max(1, hz * self.SLICE_NS // 1_000_000_000)
+
+        self.start_ns = time.perf_counter_ns()
+        self.start_cycles = 0
+
+    def start(self, cycles: int) -> None:
+        self.start_ns = time.perf_counter_ns()
+        self.start_cycles = cycles
+
+    def throttle(self, cycles: int) -> None:
+        # sleep until the cpu is due to have executed this many cycles
+        if self.hz is None: return
+
+        due_ns = self.start_ns + \
+            (cycles - self.start_cycles) * 1_000_000_000 // self.hz
+        ahead_ns = due_ns - time.perf_counter_ns()
+
+        if ahead_ns > 0:
+            time.sleep(ahead_ns / 1_000_000_000)
+        elif ahead_ns < -self.MAX_DRIFT_NS:
+            self.start(cycles)
+
+    def effective_hz(self, cycles: int) -> float:
+        # the clock rate achieved since the clock was last (re)started
+        elapsed_ns = time.perf_counter_ns() - self.start_ns
+        if elapsed_ns == 0: return 0.0
+        return (cycles - self.start_cycles) * 1_000_000_000 / elapsed_ns
@@ -1,16 +1,26 @@
-from datetime import timedelta
-from typing import Optional
-from time import sleep
+import struct
+from collections.abc import Callable
 
 from random import randint
 
 from components.mm_component import MemoryMappedComponent
+from components.dispatch import build_dispatch_table, NO_PENALTY, \
+    PAGE_PENALTY, BRANCH_PENALTY
+from components.translator import Translator
+from components.idle import IdleLoops
+from components.snapshot import write_snapshot, read_snapshot
 
 # TODO: wrap the program counter a $ffff
 
 MAX_ADDR = 65535
 ACC_ADDR = -0xacc
 
+# pc, sp, ra, rx, ry, status, cycles
+CPU_STATE = struct.Struct("<HBBBBBQ")
+# components whose sections are big, and are stored raw so that loading a
+# snapshot can map them rather than decompressing them
+RAW_SECTIONS = ("ram", "blockdevs")
+
 def build_word(high: int, low: int) -> int:
     return (high << 8) | low
 
@@ -30,187 +40,216 @@ class Isa:
         self.cpu = cpu
         self.opcodes = {
             # http://www.6502.org/users/obelisk/6502/reference.html
-            
-            0xea: (self.nop, None),
-            
-            0xa9: (self.lda, self.addr_immediate),
-            0xa5: (self.lda, self.addr_zero_page),
-            0xb5: (self.lda, self.addr_zero_page_x),
-            0xad: (self.lda, self.addr_absolute),
-            0xbd: (self.lda, self.addr_absolute_x),
-            0xb9: (self.lda, self.addr_absolute_y),
-            0xa1: (self.lda, self.addr_indexed_indirect),
-            0xb1: (self.lda, self.addr_indirect_indexed),
-            
-            0xa2: (self.ldx, self.addr_immediate),
-            0xa6: (self.ldx, self.addr_zero_page),
-            0xb6: (self.ldx, self.addr_zero_page_y),
-            0xae: (self.ldx, self.addr_absolute),
-            0xbe: (self.ldx, self.addr_absolute_y),
-            
-            0xa0: (self.ldy, self.addr_immediate),
-            0xa4: (self.ldy, self.addr_zero_page),
-            0xb4: (self.ldy, self.addr_zero_page_x),
-            0xac: (self.ldy, self.addr_absolute),
-            0xbc: (self.ldy, self.addr_absolute_x),
-            
-            0x85: (self.sta, self.addr_zero_page),
-            0x95: (self.sta, self.addr_zero_page_x),
-            0x8d: (self.sta, self.addr_absolute),
-            0x9d: (self.sta, self.addr_absolute_x),
-            0x99: (self.sta, self.addr_absolute_y),
-            0x81: (self.sta, self.addr_indexed_indirect),
-            0x91: (self.sta, self.addr_indirect_indexed),
-            
-            0x86: (self.stx, self.addr_zero_page),
-            0x96: (self.stx, self.addr_zero_page_y),
-            0x8e: (self.stx, self.addr_absolute),
-            
-            0x84: (self.sty, self.addr_zero_page),
-            0x94: (self.sty, self.addr_zero_page_x),
-            0x8c: (self.sty, self.addr_absolute),
-            
-            0x4c: (self.jmp, self.addr_absolute),
-            0x6c: (self.jmp, self.addr_indirect),
-            
-            0xf0: (self.beq, self.addr_relative),
-            0xd0: (self.bne, self.addr_relative),
-            0xb0: (self.bcs, self.addr_relative),
-            0x90: (self.bcc, self.addr_relative),
-            0x70: (self.bvs, self.addr_relative),
-            0x50: (self.bvc, self.addr_relative),
-            0x30: (self.bmi, self.addr_relative),
-            0x10: (self.bpl, self.addr_relative),
-            
-            0xe6: (self.inc, self.addr_zero_page),
-            0xf6: (self.inc, self.addr_zero_page_x),
-            0xee: (self.inc, self.addr_absolute),
-            0xfe: (self.inc, self.addr_absolute_x),
-            
-            0xe8: (self.inx, None),
-            0xc8: (self.iny, None),
-            
-            0xc6: (self.dec, self.addr_zero_page),
-            0xd6: (self.dec, self.addr_zero_page_x),
-            0xce: (self.dec, self.addr_absolute),
-            0xde: (self.dec, self.addr_absolute_x),
-            
-            0xca: (self.dex, None),
-            0x88: (self.dey, None),
-            
-            0x20: (self.jsr, self.addr_absolute),
-            0x60: (self.rts, None),
-            
-            0xc9: (self.cmp, self.addr_immediate),
-            0xc5: (self.cmp, self.addr_zero_page),
-            0xd5: (self.cmp, self.addr_zero_page_x),
-            0xcd: (self.cmp, self.addr_absolute),
-            0xdd: (self.cmp, self.addr_absolute_x),
-            0xd9: (self.cmp, self.addr_absolute_y),
-            0xc1: (self.cmp, self.addr_indexed_indirect),
-            0xd1: (self.cmp, self.addr_indirect_indexed),
-            
-            0xe0: (self.cpx, self.addr_immediate),
-            0xe4: (self.cpx, self.addr_zero_page),
-            0xec: (self.cpx, self.addr_absolute),
-            
-            0xc0: (self.cpy, self.addr_immediate),
-            0xc4: (self.cpy, self.addr_zero_page),
-            0xcc: (self.cpy, self.addr_absolute),
-            
-            0x69: (self.adc, self.addr_immediate),
-            0x65: (self.adc, self.addr_zero_page),
-            0x75: (self.adc, self.addr_zero_page_x),
-            0x6d: (self.adc, self.addr_absolute),
-            0x7d: (self.adc, self.addr_absolute_x),
-            0x79: (self.adc, self.addr_absolute_y),
-            0x61: (self.adc, self.addr_indexed_indirect),
-            0x71: (self.adc, self.addr_indirect_indexed),
-            
-            0xe9: (self.sbc, self.addr_immediate),
-            0xe5: (self.sbc, self.addr_zero_page),
-            0xf5: (self.sbc, self.addr_zero_page_x),
-            0xed: (self.sbc, self.addr_absolute),
-            0xfd: (self.sbc, self.addr_absolute_x),
-            0xf9: (self.sbc, self.addr_absolute_y),
-            0xe1: (self.sbc, self.addr_indexed_indirect),
-            0xf1: (self.sbc, self.addr_indirect_indexed),
-            
-            0x38: (self.sec, None),
-            0x18: (self.clc, None),
-            
-            0xf8: (self.sed, None),
-            0xd8: (self.cld, None),
-            
-            0x78: (self.sei, None),
-            0x58: (self.cli, None),
-            
-            0xb8: (self.clv, None),
-            
-            0xaa: (self.tax, None),
-            0xa8: (self.tay, None),
-            0x8a: (self.txa, None),
-            0x98: (self.tya, None),
-            
-            0x0a: (self.asl, self.addr_accumulator),
-            0x06: (self.asl, self.addr_zero_page),
-            0x16: (self.asl, self.addr_zero_page_x),
-            0x0e: (self.asl, self.addr_absolute),
-            0x1e: (self.asl, self.addr_absolute_x),
-            
-            0x4a: (self.lsr, self.addr_accumulator),
-            0x46: (self.lsr, self.addr_zero_page),
-            0x56: (self.lsr, self.addr_zero_page_x),
-            0x4e: (self.lsr, self.addr_absolute),
-            0x5e: (self.lsr, self.addr_absolute_x),
-            
-            0x09: (self.ora, self.addr_immediate),
-            0x05: (self.ora, self.addr_zero_page),
-            0x15: (self.ora, self.addr_zero_page_x),
-            0x0d: (self.ora, self.addr_absolute),
-            0x1d: (self.ora, self.addr_absolute_x),
-            0x19: (self.ora, self.addr_absolute_y),
-            0x01: (self.ora, self.addr_indexed_indirect),
-            0x11: (self.ora, self.addr_indirect_indexed),
-            
-            0x49: (self.eor, self.addr_immediate),
-            0x45: (self.eor, self.addr_zero_page),
-            0x55: (self.eor, self.addr_absolute_x),
-            0x4d: (self.eor, self.addr_absolute),
-            0x5d: (self.eor, self.addr_absolute_x),
-            0x59: (self.eor, self.addr_absolute_y),
-            0x41: (self.eor, self.addr_indexed_indirect),
-            0x51: (self.eor, self.addr_indirect_indexed),
-            
-            0x29: (self.and_, self.addr_immediate),
-            0x25: (self.and_, self.addr_zero_page),
-            0x35: (self.and_, self.addr_zero_page_x),
-            0x2d: (self.and_, self.addr_absolute),
-            0x3d: (self.and_, self.addr_absolute_x),
-            0x39: (self.and_, self.addr_absolute_y),
-            0x21: (self.and_, self.addr_indexed_indirect),
-            0x31: (self.and_, self.addr_indirect_indexed),
-            
-            0x48: (self.pha, None),
-            0x68: (self.pla, None),
-            
-            0x08: (self.php, None),
-            0x28: (self.plp, None),
-            
-            0x2a: (self.rol, self.addr_accumulator),
-            0x26: (self.rol, self.addr_zero_page),
-            0x36: (self.rol, self.addr_zero_page_x),
-            0x2e: (self.rol, self.addr_absolute),
-            0x3e: (self.rol, self.addr_absolute_x),
-            
-            0x6a: (self.ror, self.addr_accumulator),
-            0x66: (self.ror, self.addr_zero_page),
-            0x76: (self.ror, self.addr_zero_page_x),
-            0x6e: (self.ror, self.addr_absolute),
-            0x7e: (self.ror, self.addr_absolute_x),
-            
-            0x24: (self.bit, self.addr_zero_page),
-            0x2c: (self.bit, self.addr_absolute),
+            # opcode: (instruction, addressing mode, cycles, cycle penalty)
+            
+            0xea: (self.nop, None, 2, NO_PENALTY),
+            # undocumented nops, which only take up space and time
+            0x1a: (self.nop, None, 2, NO_PENALTY),
+            0x3a: (self.nop, None, 2, NO_PENALTY),
+            0x5a: (self.nop, None, 2, NO_PENALTY),
+            0x7a: (self.nop, None, 2, NO_PENALTY),
+            0xda: (self.nop, None, 2, NO_PENALTY),
+            0xfa: (self.nop, None, 2, NO_PENALTY),
+            0x80: (self.nop, self.addr_immediate, 2, NO_PENALTY),
+            0x82: (self.nop, self.addr_immediate, 2, NO_PENALTY),
+            0x89: (self.nop, self.addr_immediate, 2, NO_PENALTY),
+            0xc2: (self.nop, self.addr_immediate, 2, NO_PENALTY),
+            0xe2: (self.nop, self.addr_immediate, 2, NO_PENALTY),
+            0x04: (self.nop, self.addr_zero_page, 3, NO_PENALTY),
+            0x44: (self.nop, self.addr_zero_page, 3, NO_PENALTY),
+            0x64: (self.nop, self.addr_zero_page, 3, NO_PENALTY),
+            0x14: (self.nop, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x34: (self.nop, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x54: (self.nop, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x74: (self.nop, self.addr_zero_page_x, 4, NO_PENALTY),
+            0xd4: (self.nop, self.addr_zero_page_x, 4, NO_PENALTY),
+            0xf4: (self.nop, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x0c: (self.nop, self.addr_absolute, 4, NO_PENALTY),
+            0x1c: (self.nop, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0x3c: (self.nop, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0x5c: (self.nop, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0x7c: (self.nop, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0xdc: (self.nop, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0xfc: (self.nop, self.addr_absolute_x, 4, PAGE_PENALTY),
+            
+            0xa9: (self.lda, self.addr_immediate, 2, NO_PENALTY),
+            0xa5: (self.lda, self.addr_zero_page, 3, NO_PENALTY),
+            0xb5: (self.lda, self.addr_zero_page_x, 4, NO_PENALTY),
+            0xad: (self.lda, self.addr_absolute, 4, NO_PENALTY),
+            0xbd: (self.lda, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0xb9: (self.lda, self.addr_absolute_y, 4, PAGE_PENALTY),
+            0xa1: (self.lda, self.addr_indexed_indirect, 6, NO_PENALTY),
+            0xb1: (self.lda, self.addr_indirect_indexed, 5, PAGE_PENALTY),
+            
+            0xa2: (self.ldx, self.addr_immediate, 2, NO_PENALTY),
+            0xa6: (self.ldx, self.addr_zero_page, 3, NO_PENALTY),
+            0xb6: (self.ldx, self.addr_zero_page_y, 4, NO_PENALTY),
+            0xae: (self.ldx, self.addr_absolute, 4, NO_PENALTY),
+            0xbe: (self.ldx, self.addr_absolute_y, 4, PAGE_PENALTY),
+            
+            0xa0: (self.ldy, self.addr_immediate, 2, NO_PENALTY),
+            0xa4: (self.ldy, self.addr_zero_page, 3, NO_PENALTY),
+            0xb4: (self.ldy, self.addr_zero_page_x, 4, NO_PENALTY),
+            0xac: (self.ldy, self.addr_absolute, 4, NO_PENALTY),
+            0xbc: (self.ldy, self.addr_absolute_x, 4, PAGE_PENALTY),
+            
+            0x85: (self.sta, self.addr_zero_page, 3, NO_PENALTY),
+            0x95: (self.sta, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x8d: (self.sta, self.addr_absolute, 4, NO_PENALTY),
+            0x9d: (self.sta, self.addr_absolute_x, 5, NO_PENALTY),
+            0x99: (self.sta, self.addr_absolute_y, 5, NO_PENALTY),
+            0x81: (self.sta, self.addr_indexed_indirect, 6, NO_PENALTY),
+            0x91: (self.sta, self.addr_indirect_indexed, 6, NO_PENALTY),
+            
+            0x86: (self.stx, self.addr_zero_page, 3, NO_PENALTY),
+            0x96: (self.stx, self.addr_zero_page_y, 4, NO_PENALTY),
+            0x8e: (self.stx, self.addr_absolute, 4, NO_PENALTY),
+            
+            0x84: (self.sty, self.addr_zero_page, 3, NO_PENALTY),
+            0x94: (self.sty, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x8c: (self.sty, self.addr_absolute, 4, NO_PENALTY),
+            
+            0x4c: (self.jmp, self.addr_absolute, 3, NO_PENALTY),
+            0x6c: (self.jmp, self.addr_indirect, 5, NO_PENALTY),
+            
+            0xf0: (self.beq, self.addr_relative, 2, BRANCH_PENALTY),
+            0xd0: (self.bne, self.addr_relative, 2, BRANCH_PENALTY),
+            0xb0: (self.bcs, self.addr_relative, 2, BRANCH_PENALTY),
+            0x90: (self.bcc, self.addr_relative, 2, BRANCH_PENALTY),
+            0x70: (self.bvs, self.addr_relative, 2, BRANCH_PENALTY),
+            0x50: (self.bvc, self.addr_relative, 2, BRANCH_PENALTY),
+            0x30: (self.bmi, self.addr_relative, 2, BRANCH_PENALTY),
+            0x10: (self.bpl, self.addr_relative, 2, BRANCH_PENALTY),
+            
+            0xe6: (self.inc, self.addr_zero_page, 5, NO_PENALTY),
+            0xf6: (self.inc, self.addr_zero_page_x, 6, NO_PENALTY),
+            0xee: (self.inc, self.addr_absolute, 6, NO_PENALTY),
+            0xfe: (self.inc, self.addr_absolute_x, 7, NO_PENALTY),
+            
+            0xe8: (self.inx, None, 2, NO_PENALTY),
+            0xc8: (self.iny, None, 2, NO_PENALTY),
+            
+            0xc6: (self.dec, self.addr_zero_page, 5, NO_PENALTY),
+            0xd6: (self.dec, self.addr_zero_page_x, 6, NO_PENALTY),
+            0xce: (self.dec, self.addr_absolute, 6, NO_PENALTY),
+            0xde: (self.dec, self.addr_absolute_x, 7, NO_PENALTY),
+            
+            0xca: (self.dex, None, 2, NO_PENALTY),
+            0x88: (self.dey, None, 2, NO_PENALTY),
+            
+            0x20: (self.jsr, self.addr_absolute, 6, NO_PENALTY),
+            0x60: (self.rts, None, 6, NO_PENALTY),
+            
+            0xc9: (self.cmp, self.addr_immediate, 2, NO_PENALTY),
+            0xc5: (self.cmp, self.addr_zero_page, 3, NO_PENALTY),
+            0xd5: (self.cmp, self.addr_zero_page_x, 4, NO_PENALTY),
+            0xcd: (self.cmp, self.addr_absolute, 4, NO_PENALTY),
+            0xdd: (self.cmp, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0xd9: (self.cmp, self.addr_absolute_y, 4, PAGE_PENALTY),
+            0xc1: (self.cmp, self.addr_indexed_indirect, 6, NO_PENALTY),
+            0xd1: (self.cmp, self.addr_indirect_indexed, 5, PAGE_PENALTY),
+            
+            0xe0: (self.cpx, self.addr_immediate, 2, NO_PENALTY),
+            0xe4: (self.cpx, self.addr_zero_page, 3, NO_PENALTY),
+            0xec: (self.cpx, self.addr_absolute, 4, NO_PENALTY),
+            
+            0xc0: (self.cpy, self.addr_immediate, 2, NO_PENALTY),
+            0xc4: (self.cpy, self.addr_zero_page, 3, NO_PENALTY),
+            0xcc: (self.cpy, self.addr_absolute, 4, NO_PENALTY),
+            
+            0x69: (self.adc, self.addr_immediate, 2, NO_PENALTY),
+            0x65: (self.adc, self.addr_zero_page, 3, NO_PENALTY),
+            0x75: (self.adc, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x6d: (self.adc, self.addr_absolute, 4, NO_PENALTY),
+            0x7d: (self.adc, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0x79: (self.adc, self.addr_absolute_y, 4, PAGE_PENALTY),
+            0x61: (self.adc, self.addr_indexed_indirect, 6, NO_PENALTY),
+            0x71: (self.adc, self.addr_indirect_indexed, 5, PAGE_PENALTY),
+            
+            0xe9: (self.sbc, self.addr_immediate, 2, NO_PENALTY),
+            0xe5: (self.sbc, self.addr_zero_page, 3, NO_PENALTY),
+            0xf5: (self.sbc, self.addr_zero_page_x, 4, NO_PENALTY),
+            0xed: (self.sbc, self.addr_absolute, 4, NO_PENALTY),
+            0xfd: (self.sbc, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0xf9: (self.sbc, self.addr_absolute_y, 4, PAGE_PENALTY),
+            0xe1: (self.sbc, self.addr_indexed_indirect, 6, NO_PENALTY),
+            0xf1: (self.sbc, self.addr_indirect_indexed, 5, PAGE_PENALTY),
+            
+            0x38: (self.sec, None, 2, NO_PENALTY),
+            0x18: (self.clc, None, 2, NO_PENALTY),
+            
+            0xf8: (self.sed, None, 2, NO_PENALTY),
+            0xd8: (self.cld, None, 2, NO_PENALTY),
+            
+            0x78: (self.sei, None, 2, NO_PENALTY),
+            0x58: (self.cli, None, 2, NO_PENALTY),
+            
+            0xb8: (self.clv, None, 2, NO_PENALTY),
+            
+            0xaa: (self.tax, None, 2, NO_PENALTY),
+            0xa8: (self.tay, None, 2, NO_PENALTY),
+            0x8a: (self.txa, None, 2, NO_PENALTY),
+            0x98: (self.tya, None, 2, NO_PENALTY),
+            
+            0x0a: (self.asl, self.addr_accumulator, 2, NO_PENALTY),
+            0x06: (self.asl, self.addr_zero_page, 5, NO_PENALTY),
+            0x16: (self.asl, self.addr_zero_page_x, 6, NO_PENALTY),
+            0x0e: (self.asl, self.addr_absolute, 6, NO_PENALTY),
+            0x1e: (self.asl, self.addr_absolute_x, 7, NO_PENALTY),
+            
+            0x4a: (self.lsr, self.addr_accumulator, 2, NO_PENALTY),
+            0x46: (self.lsr, self.addr_zero_page, 5, NO_PENALTY),
+            0x56: (self.lsr, self.addr_zero_page_x, 6, NO_PENALTY),
+            0x4e: (self.lsr, self.addr_absolute, 6, NO_PENALTY),
+            0x5e: (self.lsr, self.addr_absolute_x, 7, NO_PENALTY),
+            
+            0x09: (self.ora, self.addr_immediate, 2, NO_PENALTY),
+            0x05: (self.ora, self.addr_zero_page, 3, NO_PENALTY),
+            0x15: (self.ora, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x0d: (self.ora, self.addr_absolute, 4, NO_PENALTY),
+            0x1d: (self.ora, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0x19: (self.ora, self.addr_absolute_y, 4, PAGE_PENALTY),
+            0x01: (self.ora, self.addr_indexed_indirect, 6, NO_PENALTY),
+            0x11: (self.ora, self.addr_indirect_indexed, 5, PAGE_PENALTY),
+            
+            0x49: (self.eor, self.addr_immediate, 2, NO_PENALTY),
+            0x45: (self.eor, self.addr_zero_page, 3, NO_PENALTY),
+            0x55: (self.eor, self.addr_absolute_x, 4, NO_PENALTY),
+            0x4d: (self.eor, self.addr_absolute, 4, NO_PENALTY),
+            0x5d: (self.eor, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0x59: (self.eor, self.addr_absolute_y, 4, PAGE_PENALTY),
+            0x41: (self.eor, self.addr_indexed_indirect, 6, NO_PENALTY),
+            0x51: (self.eor, self.addr_indirect_indexed, 5, PAGE_PENALTY),
+            
+            0x29: (self.and_, self.addr_immediate, 2, NO_PENALTY),
+            0x25: (self.and_, self.addr_zero_page, 3, NO_PENALTY),
+            0x35: (self.and_, self.addr_zero_page_x, 4, NO_PENALTY),
+            0x2d: (self.and_, self.addr_absolute, 4, NO_PENALTY),
+            0x3d: (self.and_, self.addr_absolute_x, 4, PAGE_PENALTY),
+            0x39: (self.and_, self.addr_absolute_y, 4, PAGE_PENALTY),
+            0x21: (self.and_, self.addr_indexed_indirect, 6, NO_PENALTY),
+            0x31: (self.and_, self.addr_indirect_indexed, 5, PAGE_PENALTY),
+            
+            0x48: (self.pha, None, 3, NO_PENALTY),
+            0x68: (self.pla, None, 4, NO_PENALTY),
+            
+            0x08: (self.php, None, 3, NO_PENALTY),
+            0x28: (self.plp, None, 4, NO_PENALTY),
+            
+            0x2a: (self.rol, self.addr_accumulator, 2, NO_PENALTY),
+            0x26: (self.rol, self.addr_zero_page, 5, NO_PENALTY),
+            0x36: (self.rol, self.addr_zero_page_x, 6, NO_PENALTY),
+            0x2e: (self.rol, self.addr_absolute, 6, NO_PENALTY),
+            0x3e: (self.rol, self.addr_absolute_x, 7, NO_PENALTY),
+            
+            0x6a: (self.ror, self.addr_accumulator, 2, NO_PENALTY),
+            0x66: (self.ror, self.addr_zero_page, 5, NO_PENALTY),
+            0x76: (self.ror, self.addr_zero_page_x, 6, NO_PENALTY),
+            0x6e: (self.ror, self.addr_absolute, 6, NO_PENALTY),
+            0x7e: (self.ror, self.addr_absolute_x, 7, NO_PENALTY),
+            
+            0x24: (self.bit, self.addr_zero_page, 3, NO_PENALTY),
+            0x2c: (self.bit, self.addr_absolute, 4, NO_PENALTY),
         }
         
     def addr_immediate(self) -> int:
@@ -294,7 +333,7 @@ class Isa:
         return build_word(high_addr, low_addr)
     
     def nop(self, addr: int, opdcode: int) -> None:
-        return sleep(0.01)
+        pass
 
     def ld_reg(self, addr: int) -> int:
         value = self.cpu.fetch(addr)
@@ -318,22 +357,25 @@ class Isa:
     def jmp(self, addr: int, opcode: int) -> None:
         self.cpu.pc = addr
         
-    def beq(self, addr: int, opcode: int) -> int:
-        if self.cpu.zero: self.cpu.pc = addr
-    def bne(self, addr: int, opcode: int) -> int:
-        if not self.cpu.zero: self.cpu.pc = addr
-    def bcs(self, addr: int, opcode: int) -> int:
-        if self.cpu.carry: self.cpu.pc = addr
-    def bcc(self, addr: int, opcode: int) -> int:
-        if not self.cpu.carry: self.cpu.pc = addr
-    def bvs(self, addr: int, opcode: int) -> int:
-        if self.cpu.overflow: self.cpu.pc = addr
-    def bvc(self, addr: int, opcode: int) -> int:
-        if not self.cpu.overflow: self.cpu.pc = addr
-    def bmi(self, addr: int, opcode: int) -> int:
-        if self.cpu.negative: self.cpu.pc = addr
-    def bpl(self, addr: int, opcode: int) -> int:
-        if not self.cpu.negative: self.cpu.pc = addr
+    def branch(self, condition: bool, addr: int) -> bool:
+        if condition: self.cpu.pc = addr
+        return condition
+    def beq(self, addr: int, opcode: int) -> bool:
+        return self.branch(self.cpu.zero, addr)
+    def bne(self, addr: int, opcode: int) -> bool:
+        return self.branch(not self.cpu.zero, addr)
+    def bcs(self, addr: int, opcode: int) -> bool:
+        return self.branch(self.cpu.carry, addr)
+    def bcc(self, addr: int, opcode: int) -> bool:
+        return self.branch(not self.cpu.carry, addr)
+    def bvs(self, addr: int, opcode: int) -> bool:
+        return self.branch(self.cpu.overflow, addr)
+    def bvc(self, addr: int, opcode: int) -> bool:
+        return self.branch(not self.cpu.overflow, addr)
+    def bmi(self, addr: int, opcode: int) -> bool:
+        return self.branch(self.cpu.negative, addr)
+    def bpl(self, addr: int, opcode: int) -> bool:
+        return self.branch(not self.cpu.negative, addr)
         
     def add_val(self, val: int, add: int) -> int:
         result = (val + add) & 0xff
@@ -490,18 +532,36 @@ class Cpu:
     def __init__(self, components: dict[str, MemoryMappedComponent]) -> None:
         self.mm_components = components
         
-        self.mm_component_map: list[MemoryMappedComponent | None] = []
-        for i in range(MAX_ADDR+1):
-            component = None
-            for c in self.mm_components.values():
-                if c.contains(i):
-                    component = c
-                    break
-            self.mm_component_map.append(component)
+        # address -> component. where components overlap, the first one
+        # listed wins, so they are mapped last.
+        self.mm_component_map: list[MemoryMappedComponent | None] = \
+            [None] * (MAX_ADDR+1)
+        for c in reversed(list(self.mm_components.values())):
+            for first, last in c.address_ranges():
+                last = min(last, MAX_ADDR)
+                self.mm_component_map[first:last+1] = [c] * (last - first + 1)
+        
+        self.map_pages()
+        for c in self.mm_components.values(): c.attach(self)
             
         self.isa = Isa(self)
+        # the last instructions run, if they are being traced (see
+        # components/trace.py)
+        self.trace = None
+        
+        # opcode -> compiled handler, see components/dispatch.py
+        self.dispatch = build_dispatch_table(self)
+        self.mnemonics = [None] * 256
+        for opcode, (instr_func, *_) in self.isa.opcodes.items():
+            self.mnemonics[opcode] = instr_func.__name__
+        
+        # busy-wait detection, see components/idle.py
+        self.idle = IdleLoops(self)
+        # compiled blocks of guest code, see components/translator.py
+        self.translator = Translator(self)
         
         self.pc = 0
+        self.cycles = 0
         self.sp = randint(0, 0xff)
         self.ra = randint(0, 0xff)
         self.rx = randint(0, 0xff)
@@ -555,6 +615,35 @@ class Cpu:
         self.overflow = bool(p & 0x40)
         self.negative = bool(p & 0x80)
 
+    def map_pages(self) -> None:
+        # plain memory (ram & rom) lives in one flat bytearray, and each 256
+        # byte page has a fetch & write handler, which is None if the page can
+        # be accessed in `memory` directly. only pages that are not entirely
+        # plain memory (like the device block) go through their components.
+        self.memory = bytearray(MAX_ADDR+1)
+        view = memoryview(self.memory)
+        
+        for c in self.mm_components.values():
+            if not c.plain_memory: continue
+            view[c.start:c.end+1] = c.addresses
+            c.addresses = view[c.start:c.end+1]
+        
+        self.fetch_handlers: list[Callable[[int], int] | None] = []
+        self.write_handlers: list[Callable[[int, int], None] | None] = []
+        for page in range(0x100):
+            owners = set(self.mm_component_map[page << 8:(page+1) << 8])
+            c = owners.pop() if len(owners) == 1 else None
+            
+            if c is None or not c.plain_memory:
+                self.fetch_handlers.append(self.fetch_component)
+                self.write_handlers.append(self.write_component)
+            elif c.read_only:
+                self.fetch_handlers.append(None)
+                self.write_handlers.append(c.write)
+            else:
+                self.fetch_handlers.append(None)
+                self.write_handlers.append(None)
+        
     def reset(self) -> None:
         low  = self.fetch(0xfffc)
         high = self.fetch(0xfffd)
@@ -565,22 +654,30 @@ class Cpu:
         if c is None: raise IndexError(f"Unmapped memory area accessed (${addr:04x}).")
         return c
     
+    def fetch_component(self, addr: int) -> int:
+        return self.resolve_component(addr).fetch(addr)
+    
+    def write_component(self, addr: int, val: int) -> None:
+        self.resolve_component(addr).write(addr, val)
+    
     def fetch(self, addr: int) -> int:
         if addr == ACC_ADDR:
             return self.ra
         
-        c = self.resolve_component(addr)
-        return c.fetch(addr)
+        handler = self.fetch_handlers[addr >> 8]
+        if handler is None: return self.memory[addr]
+        return handler(addr)
     
     def write(self, addr: int, val: int) -> None:
         if addr == ACC_ADDR:
             self.ra = val
             return
         
-        c = self.resolve_component(addr)
-        c.write(addr, val)
+        handler = self.write_handlers[addr >> 8]
+        if handler is None: self.memory[addr] = val & 0xff
+        else: handler(addr, val)
         
-    def decode(self) -> tuple[int, callable, int, int]:
+    def decode(self) -> tuple[int, callable, int]:
         opcode = self.fetch(self.pc)
         self.pc += 1
         
@@ -588,19 +685,117 @@ class Cpu:
             self.pc += 1
             raise NotImplementedError(f"Opcode 0x{opcode:02x} not implemented")
         
-        instr_func, addr_mode_func = self.isa.opcodes[opcode]
+        instr_func, addr_mode_func, _, _ = self.isa.opcodes[opcode]
         addr = None if addr_mode_func is None else addr_mode_func()
         
         return addr, instr_func, opcode
     
-    def execute(self) -> str:
+    def instruction_cycles(self, opcode: int, addr: int, next_pc: int,
+                           taken: bool) -> int:
+        _, addr_mode_func, cycles, penalty = self.isa.opcodes[opcode]
+        
+        if penalty == PAGE_PENALTY:
+            index = self.rx if addr_mode_func == self.isa.addr_absolute_x \
+                else self.ry
+            base = (addr - index) & 0xffff
+            if (base ^ addr) & 0xff00: cycles += 1
+        
+        elif penalty == BRANCH_PENALTY and taken:
+            cycles += 1
+            if (next_pc ^ addr) & 0xff00: cycles += 1
+            
+        return cycles
+    
+    def interpret(self) -> str:
+        # the original, slower execution path through the `Isa` methods. this
+        # is kept as a reference for the compiled handlers in `dispatch`.
         addr, instr_func, opcode = self.decode()
+        next_pc = self.pc
         
-        instr_func(addr, opcode)
+        taken = instr_func(addr, opcode)
         self.ensure_wrap()
         
+        self.cycles += self.instruction_cycles(opcode, addr, next_pc, taken)
+        
         return instr_func.__name__
+    
+    def execute(self) -> str:
+        opcode = self.fetch(self.pc)
+        self.dispatch[opcode]()
+        return self.mnemonics[opcode]
+    
+    def run(self, instructions: int) -> int:
+        # execute at least this many instructions, a whole translated block at
+        # a time, and return the number actually executed
+        blocks = self.translator.blocks
+        translate = self.translator.translate
+        
+        executed = 0
+        while executed < instructions:
+            block = blocks.get(self.pc)
+            if block is None: block = translate(self.pc)
+            executed += block()
+            
+        return executed
+    
+    def run_cycles(self, cycles: int) -> int:
+        # the same as `run`, but for at least this many clock cycles
+        blocks = self.translator.blocks
+        translate = self.translator.translate
+        
+        start = self.cycles
+        target = start + cycles
+        while self.cycles < target:
+            block = blocks.get(self.pc)
+            if block is None: block = translate(self.pc)
+            block()
+            
+        return self.cycles - start
 
+    def set_trace(self, trace) -> None:
+        # start recording instructions into a `Trace`, or stop if it's None.
+        # all code has to be compiled again, with or without the recording.
+        self.trace = trace
+        if trace is not None: trace.attach(self)
+        self.dispatch = build_dispatch_table(self)
+        self.translator.namespace["trace"] = \
+            None if trace is None else trace.record
+        self.translator.flush()
+        
+    def save_state(self, path: str, compress: bool = True) -> None:
+        # snapshot the whole machine to a file (see components/snapshot.py).
+        # each component's sections are named after it, like "blockdevs/0".
+        # `compress` only applies to the small ones (see RAW_SECTIONS).
+        sections = {"cpu": CPU_STATE.pack(
+            self.pc, self.sp, self.ra, self.rx, self.ry,
+            self.pack_status(self.break_flag), self.cycles)}
+        
+        for name, c in self.mm_components.items():
+            for key, data in c.save_state().items():
+                sections[f"{name}/{key}" if key else name] = data
+        
+        raw = {key for key in sections
+               if key.partition("/")[0] in RAW_SECTIONS}
+        write_snapshot(path, sections, compress, raw)
+        
+    def load_state(self, path: str) -> None:
+        # restore a snapshot taken by `save_state`, on a machine made up of
+        # the same components
+        sections = read_snapshot(path)
+        
+        self.pc, self.sp, self.ra, self.rx, self.ry, status, self.cycles = \
+            CPU_STATE.unpack(sections["cpu"])
+        self.unpack_status(status)
+        
+        for name, c in self.mm_components.items():
+            c.load_state({
+                key[len(name) + 1:]: data for key, data in sections.items()
+                if key == name or key.startswith(name + "/")
+            })
+        
+        # memory changed behind the translator's back
+        self.translator.flush()
+        
     def visualise(self, op_name) -> None:
         print(f"Last Instruction")
         print(f"| op:   {op_name}")
@@ -611,6 +806,7 @@ class Cpu:
         
         print(f"\nRegisters:")
         print(f"| pc: 0x{self.pc:04x}")
+        print(f"| cycles: {self.cycles}")
         print_reg("ra", self.ra)
         print_reg("rx", self.rx)
         print_reg("ry", self.ry)
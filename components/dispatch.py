@@ -0,0 +1,355 @@
+import re
+from functools import lru_cache
+from collections.abc import Callable
+
+# each instruction in the isa is turned into python source and compiled into a
+# single function per opcode, so executing an instruction is one list index and
+# one call, with the addressing mode inlined into the instruction body.
+#
+# inside the generated source:
+#   - `pc` is a local holding the address of the next byte to be read, and is
+#     left pointing at the next instruction (jumps and branches assign to it)
+#   - addressing modes leave the effective address in `addr`
+#   - `{load}` reads the operand and `{store}` writes the local `v` back to it
+
+# extra cycles taken by some instructions, on top of their base cycle count
+NO_PENALTY = 0
+PAGE_PENALTY = 1   # +1 if indexing crosses into another page
+BRANCH_PENALTY = 2 # +1 if the branch is taken, +2 if it lands on another page
+
+# addressing modes, reading their operands from memory at `pc`. indexed modes
+# leave the address before indexing in `base`.
+ADDR_MODES: dict[str | None, str] = {
+    None: "",
+    "addr_accumulator": "",
+    "addr_immediate": "addr = pc\npc += 1",
+    "addr_relative": "addr = (pc + 1 + (fetch(pc) ^ 0x80) - 0x80) & 0xffff\n"
+                     "pc += 1",
+    "addr_zero_page": "addr = fetch(pc)\npc += 1",
+    "addr_zero_page_x": "addr = (fetch(pc) + cpu.rx) & 0xff\npc += 1",
+    "addr_zero_page_y": "addr = (fetch(pc) + cpu.ry) & 0xff\npc += 1",
+    "addr_absolute": "addr = fetch(pc) | fetch(pc + 1) << 8\npc += 2",
+    "addr_absolute_x": "base = fetch(pc) | fetch(pc + 1) << 8\n"
+                       "addr = (base + cpu.rx) & 0xffff\n"
+                       "pc += 2",
+    "addr_absolute_y": "base = fetch(pc) | fetch(pc + 1) << 8\n"
+                       "addr = (base + cpu.ry) & 0xffff\n"
+                       "pc += 2",
+    "addr_indexed_indirect": "ptr = (fetch(pc) + cpu.rx) & 0xff\n"
+                             "addr = fetch(ptr) | fetch((ptr + 1) & 0xff) << 8\n"
+                             "pc += 1",
+    "addr_indirect_indexed": "ptr = fetch(pc)\n"
+                             "base = fetch(ptr) | fetch((ptr + 1) & 0xff) << 8\n"
+                             "addr = (base + cpu.ry) & 0xffff\n"
+                             "pc += 1",
+    "addr_indirect": "ptr = fetch(pc) | fetch(pc + 1) << 8\n"
+                     "addr = fetch(ptr) | fetch(ptr + 1) << 8\n"
+                     "pc += 2",
+}
+
+# the extra cycles for a taken branch, from `pc` to `addr`
+BRANCH_CYCLES = "1 if (pc ^ addr) < 0x100 else 2"
+
+# the extra cycle for indexing from `base` into another page
+PAGE_CROSS = "if (base ^ addr) > 0xff:\n    cpu.cycles += 1"
+
+def operand_access(mode: str | None) -> dict[str, str]:
+    if mode == "addr_accumulator":
+        return {"load": "cpu.ra", "store": "cpu.ra = v"}
+    return {"load": "fetch(addr)", "store": "write(addr, v)",
+            "taken": BRANCH_CYCLES}
+
+SET_NZ = "cpu.zero = v == 0\ncpu.negative = v > 0x7f"
+
+def load_reg(reg: str) -> str:
+    return f"v = {{load}}\n{SET_NZ}\ncpu.{reg} = v"
+
+def store_reg(reg: str) -> str:
+    return f"v = cpu.{reg}\n{{store}}"
+
+def branch(condition: str) -> str:
+    return f"if {condition}:\n    cpu.cycles += {{taken}}\n    pc = addr"
+
+def step_reg(reg: str, step: int) -> str:
+    return f"v = (cpu.{reg} {'+' if step > 0 else '-'} 1) & 0xff\n{SET_NZ}\n" \
+           f"cpu.{reg} = v"
+
+def step_mem(step: int) -> str:
+    return f"v = ({{load}} {'+' if step > 0 else '-'} 1) & 0xff\n{SET_NZ}\n" \
+           "{store}"
+
+def compare(reg: str) -> str:
+    return f"m = {{load}}\nr = cpu.{reg}\ncpu.carry = r >= m\n" \
+           "cpu.zero = r == m\ncpu.negative = (r - m) & 0x80 != 0"
+
+def transfer(src: str, dest: str) -> str:
+    return f"v = cpu.{src}\n{SET_NZ}\ncpu.{dest} = v"
+
+def logic(op: str) -> str:
+    return f"v = cpu.ra {op} {{load}}\n{SET_NZ}\ncpu.ra = v"
+
+DECIMAL_CHECK = "if cpu.decimal:\n" \
+                "    cpu.pc = pc\n" \
+                "    raise NotImplementedError(\"Decimal mode is not implemented.\")"
+
+# instruction bodies, keyed by the name of the matching method on `Isa`. any
+# instruction without an entry here is compiled to a call to that method.
+INSTRUCTIONS: dict[str, str] = {
+    "nop": "pass",
+    
+    "lda": load_reg("ra"),
+    "ldx": load_reg("rx"),
+    "ldy": load_reg("ry"),
+
+    "sta": store_reg("ra"),
+    "stx": store_reg("rx"),
+    "sty": store_reg("ry"),
+
+    "jmp": "pc = addr",
+
+    "beq": branch("cpu.zero"),
+    "bne": branch("not cpu.zero"),
+    "bcs": branch("cpu.carry"),
+    "bcc": branch("not cpu.carry"),
+    "bvs": branch("cpu.overflow"),
+    "bvc": branch("not cpu.overflow"),
+    "bmi": branch("cpu.negative"),
+    "bpl": branch("not cpu.negative"),
+
+    "inc": step_mem(1),
+    "inx": step_reg("rx", 1),
+    "iny": step_reg("ry", 1),
+    "dec": step_mem(-1),
+    "dex": step_reg("rx", -1),
+    "dey": step_reg("ry", -1),
+
+    # the return address is pushed low byte first, matching `Isa.jsr`
+    "jsr": "ret = pc - 1\n"
+           "sp = cpu.sp\n"
+           "write(0x100 | sp, ret & 0xff)\n"
+           "write(0x100 | (sp - 1) & 0xff, ret >> 8 & 0xff)\n"
+           "cpu.sp = (sp - 2) & 0xff\n"
+           "pc = addr",
+    "rts": "sp = cpu.sp\n"
+           "high = fetch(0x100 | (sp + 1) & 0xff)\n"
+           "low = fetch(0x100 | (sp + 2) & 0xff)\n"
+           "cpu.sp = (sp + 2) & 0xff\n"
+           "pc = ((high << 8 | low) + 1) & 0xffff",
+
+    "cmp": compare("ra"),
+    "cpx": compare("rx"),
+    "cpy": compare("ry"),
+
+    "adc": f"{DECIMAL_CHECK}\n"
+           "a = cpu.ra\n"
+           "b = {load}\n"
+           "s = a + b + cpu.carry\n"
+           "cpu.carry = s > 0xff\n"
+           "v = s & 0xff\n"
+           f"{SET_NZ}\n"
+           "cpu.overflow = (a ^ v) & (b ^ v) & 0x80 != 0\n"
+           "cpu.ra = v",
+    "sbc": f"{DECIMAL_CHECK}\n"
+           "a = cpu.ra\n"
+           "b = {load} ^ 0xff\n"
+           "s = a + b + cpu.carry\n"
+           "cpu.carry = s > 0xff\n"
+           "v = s & 0xff\n"
+           f"{SET_NZ}\n"
+           "cpu.overflow = (a ^ v) & (~b ^ v) & 0x80 != 0\n"
+           "cpu.ra = v",
+
+    "sec": "cpu.carry = True",
+    "clc": "cpu.carry = False",
+    "sed": "cpu.decimal = True",
+    "cld": "cpu.decimal = False",
+    "sei": "cpu.interrupt_disable = True",
+    "cli": "cpu.interrupt_disable = False",
+    "clv": "cpu.overflow = False",
+
+    "tax": transfer("ra", "rx"),
+    "tay": transfer("ra", "ry"),
+    "txa": transfer("rx", "ra"),
+    "tya": transfer("ry", "ra"),
+    "tsx": transfer("sp", "rx"),
+    "txs": "cpu.sp = cpu.rx",
+
+    "asl": "v = {load}\n"
+           "cpu.carry = v > 0x7f\n"
+           "v = v << 1 & 0xff\n"
+           f"{SET_NZ}\n"
+           "{store}",
+    "lsr": "v = {load}\n"
+           "cpu.carry = v & 0x01 != 0\n"
+           "v >>= 1\n"
+           f"{SET_NZ}\n"
+           "{store}",
+    "rol": "m = {load}\n"
+           "v = (m << 1 | cpu.carry) & 0xff\n"
+           "cpu.carry = m > 0x7f\n"
+           f"{SET_NZ}\n"
+           "{store}",
+    "ror": "m = {load}\n"
+           "v = m >> 1 | (0x80 if cpu.carry else 0)\n"
+           "cpu.carry = m & 0x01 != 0\n"
+           f"{SET_NZ}\n"
+           "{store}",
+
+    "ora": logic("|"),
+    "eor": logic("^"),
+    "and_": logic("&"),
+
+    "pha": "sp = cpu.sp\n"
+           "write(0x100 | sp, cpu.ra)\n"
+           "cpu.sp = (sp - 1) & 0xff",
+    "pla": "sp = (cpu.sp + 1) & 0xff\n"
+           "cpu.sp = sp\n"
+           "cpu.ra = fetch(0x100 | sp)",
+    "php": "sp = cpu.sp\n"
+           "write(0x100 | sp, cpu.pack_status())\n"
+           "cpu.sp = (sp - 1) & 0xff",
+    "plp": "sp = (cpu.sp + 1) & 0xff\n"
+           "cpu.sp = sp\n"
+           "cpu.unpack_status(fetch(0x100 | sp))",
+
+    "bit": "v = {load}\n"
+           "cpu.zero = cpu.ra & v == 0\n"
+           "cpu.overflow = v & 0x40 != 0\n"
+           "cpu.negative = v > 0x7f",
+}
+
+def fallback(instr: str, mode: str | None, opcode: int) -> str:
+    # hand control to the method on `Isa`, with the cpu state it expects
+    if mode is None: addr = "None"
+    elif mode == "addr_accumulator": addr = "isa.addr_accumulator()"
+    else: addr = "addr"
+    return f"cpu.pc = pc\nisa.{instr}({addr}, 0x{opcode:02x})\npc = cpu.pc"
+
+def call_args(source: str, start: int) -> tuple[list[str], int]:
+    # split the arguments of the call whose "(" is at `start`, returning them
+    # and the index just past the closing ")"
+    args, depth, arg_start = [], 0, start + 1
+    for i in range(start, len(source)):
+        if source[i] == "(": depth += 1
+        elif source[i] == ")": depth -= 1
+        if depth == 1 and source[i] == ",":
+            args.append(source[arg_start:i].strip())
+            arg_start = i + 1
+        if depth == 0:
+            args.append(source[arg_start:i].strip())
+            return args, i + 1
+    raise SyntaxError(f"unbalanced call in {source!r}")
+
+def is_simple(expr: str) -> bool:
+    # names and numbers can be repeated without being evaluated more than once
+    return expr.isidentifier() or re.fullmatch(r"0x[0-9a-f]+", expr) is not None
+
+def inline_fetch(source: str) -> str:
+    # turn fetch(addr) into a direct read of the cpu's memory, only calling
+    # the page's handler if it has one
+    out = ""
+    while (i := source.find("fetch(")) != -1:
+        if i > 0 and (source[i-1].isalnum() or source[i-1] in "_."):
+            out += source[:i+6]
+            source = source[i+6:]
+            continue
+        (addr,), end = call_args(source, i + 5)
+        addr = inline_fetch(addr)
+        if is_simple(addr):
+            read = f"(mem[{addr}] if rd[{addr} >> 8] is None " \
+                   f"else rd[{addr} >> 8]({addr}))"
+        else:
+            read = f"(mem[_a] if rd[(_a := {addr}) >> 8] is None " \
+                   f"else rd[_a >> 8](_a))"
+        out += source[:i] + read
+        source = source[end:]
+    return out + source
+
+def inline_write(line: str) -> str:
+    # the same as `inline_fetch`, for a line that is a write(addr, val) call
+    stripped = line.lstrip()
+    if not stripped.startswith("write("): return line
+    pad = line[:len(line) - len(stripped)]
+    (addr, val), _ = call_args(stripped, 5)
+
+    lines = []
+    if not is_simple(addr):
+        lines.append(f"{pad}_a = {addr}")
+        addr = "_a"
+    lines.append(f"{pad}if wr[{addr} >> 8] is None: mem[{addr}] = {val}")
+    lines.append(f"{pad}else: wr[{addr} >> 8]({addr}, {val})")
+    return "\n".join(lines)
+
+def inline_memory_access(source: str) -> str:
+    source = inline_fetch(source)
+    return "\n".join(inline_write(line) for line in source.split("\n"))
+
+def namespace(cpu) -> dict:
+    # the globals seen by compiled code
+    return {
+        "cpu": cpu,
+        "isa": cpu.isa,
+        "mem": cpu.memory,
+        "rd": cpu.fetch_handlers,
+        "wr": cpu.write_handlers,
+        "trace": None if cpu.trace is None else cpu.trace.record,
+    }
+
+def indent(source: str, depth: int = 1) -> str:
+    pad = "    " * depth
+    return "\n".join(pad + line if line else line for line in source.split("\n"))
+
+def instruction_source(instr: str, mode: str | None, opcode: int,
+                       access: dict[str, str] | None = None) -> str:
+    body = INSTRUCTIONS.get(instr)
+    if body is None: return fallback(instr, mode, opcode)
+    return body.format(**(access or operand_access(mode)))
+
+def trace_source(pc: str, opcode: int, mode: str | None,
+                 operand: str = "fetch(addr)") -> str:
+    # record the instruction about to run in the trace (see
+    # components/trace.py), with its effective address, or for immediate
+    # instructions, the operand itself
+    if mode in (None, "addr_accumulator"): addr = "0"
+    elif mode == "addr_immediate": addr = operand
+    else: addr = "addr"
+    return f"trace({pc}, 0x{opcode:02x}, {addr})"
+
+def handler_source(opcode: int, instr: str, mode: str | None, cycles: int,
+                   penalty: int, traced: bool = False) -> str:
+    lines = [f"def op_{opcode:02x}():", "    pc = cpu.pc + 1"]
+    if ADDR_MODES[mode]: lines.append(indent(ADDR_MODES[mode]))
+    if traced: lines.append(indent(trace_source("cpu.pc", opcode, mode)))
+    lines.append(indent(instruction_source(instr, mode, opcode)))
+    if penalty == PAGE_PENALTY: lines.append(indent(PAGE_CROSS))
+    lines.append(f"    cpu.cycles += {cycles}")
+    lines.append("    cpu.pc = pc & 0xffff")
+    return "\n".join(lines)
+
+@lru_cache(maxsize=None)
+def compile_handlers(opcodes: tuple[tuple[int, str, str | None, int, int], ...],
+                     traced: bool = False):
+    source = "\n\n".join(handler_source(*op, traced) for op in opcodes)
+    return compile(inline_memory_access(source), "<dispatch>", "exec")
+
+def build_dispatch_table(cpu) -> list[Callable[[], None]]:
+    opcodes = tuple(
+        (opcode, instr.__name__, None if mode is None else mode.__name__,
+         cycles, penalty)
+        for opcode, (instr, mode, cycles, penalty) in sorted(cpu.isa.opcodes.items())
+    )
+
+    handlers = namespace(cpu)
+    exec(compile_handlers(opcodes, cpu.trace is not None), handlers)
+
+    table = [unknown_opcode(cpu, opcode) for opcode in range(256)]
+    for opcode, *_ in opcodes:
+        table[opcode] = handlers[f"op_{opcode:02x}"]
+    return table
+
+def unknown_opcode(cpu, opcode: int) -> Callable[[], None]:
+    def handler() -> None:
+        if cpu.trace is not None: cpu.trace.record(cpu.pc, opcode, 0)
+        cpu.pc += 2
+        raise NotImplementedError(f"Opcode 0x{opcode:02x} not implemented")
+    return handler
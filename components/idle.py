@@ -0,0 +1,167 @@
+import time
+import select
+
+from components.mm_component import MemoryMappedComponent
+
+# a guest busy-waiting on a device (like polling the timer until it ticks, or
+# the serial port until a key is pressed) spins through the same few blocks of
+# code forever, with nothing changing but the value read from the device. once
+# that is spotted, the host can sleep until the device could say something new
+# instead of burning a whole core.
+#
+# blocks that could be part of such a loop ("idle blocks") have no side effects
+# besides changing registers, and only read plain memory or devices that can
+# tell when they will next change (see `MemoryMappedComponent.wakeup`). since
+# plain memory only changes when the cpu writes to it, entering an idle block
+# with the same registers as last time, without running any other block in
+# between, means that the guest is stuck until one of its devices changes.
+
+IDLE_INSTRUCTIONS = {
+    "lda", "ldx", "ldy", "cmp", "cpx", "cpy", "bit", "and_", "ora", "eor",
+    "tax", "tay", "txa", "tya", "clc", "sec", "clv", "nop", "jmp",
+    "beq", "bne", "bcs", "bcc", "bvs", "bvc", "bmi", "bpl",
+}
+
+IDLE_ADDR_MODES = {
+    None, "addr_accumulator", "addr_immediate", "addr_relative",
+    "addr_zero_page", "addr_absolute",
+}
+
+class Stalled(Exception):
+    # nothing the guest is waiting on can ever change (see `IdleLoops.park`)
+    pass
+
+class OutOfTime(Exception):
+    # the cpu was parked past `IdleLoops.deadline`
+    pass
+
+class Parked(Exception):
+    # a cooperative cpu is waiting (see `IdleLoops.waiting`)
+    pass
+
+class IdleLoops:
+    """
+    IdleLoops spots the cpu busy-waiting on devices, and parks the host until
+    a read from one of them could return something new.
+
+    Translated idle blocks call `enter` when they start, and set `exit` to the
+    cycle count when they finish, so a block that starts on the exact cycle
+    the last idle block finished knows that no other code ran in between.
+
+    While parked, the cycle count moves on as if the loop had kept running at
+    `hz`, so the clock doesn't try to catch up afterwards. If `hz` is None
+    (the cpu is unlimited), the cycle count stays put, unless a device runs
+    on the cycle count (like a virtual-time `Timer`), in which case the cpu
+    skips straight to when it changes without waiting.
+
+    If the loop is only waiting on devices that can't say when they will
+    change (or on nothing but memory, like a `jmp` to itself), it is parked
+    for `MAX_PARK` at a time. With `stop_when_stalled` set, `Stalled` is
+    raised instead, for machines with nobody outside to change anything.
+
+    A loop waiting in real time could keep the cpu from getting anywhere for
+    a long time, so a `deadline` (in `time.perf_counter` seconds) can be set,
+    past which parking raises `OutOfTime`.
+
+    A `cooperative` cpu doesn't wait itself, so that something else (like
+    another machine) can run in the meantime. Parking raises `Parked` from the
+    start of the idle block, leaving the cpu as it was, with `waiting` set to
+    (when it parked, seconds, file descriptors, cycles) for how long to wait.
+    `resume` should be called once the wait is over.
+    """
+
+    MAX_PARK = 0.1 # seconds
+
+    def __init__(self, cpu) -> None:
+        self.cpu = cpu
+        self.hz: int | None = None
+        self.stop_when_stalled = False
+        self.deadline: float | None = None
+        self.cooperative = False
+        self.waiting: tuple[float, float, list[int], int | None] | None = None
+
+        # idle block start address -> the devices (and addresses) it reads
+        self.devices: dict[int, list[tuple[MemoryMappedComponent, int]]] = {}
+        # idle block start address -> registers when it was last entered,
+        # since the last time any other block ran
+        self.seen: dict[int, tuple] = {}
+        self.exit = -1
+
+        self.parks = 0
+
+    def enter(self, start: int) -> None:
+        cpu = self.cpu
+        if cpu.cycles != self.exit: self.seen.clear()
+
+        state = (cpu.ra, cpu.rx, cpu.ry, cpu.sp, cpu.carry, cpu.zero,
+                 cpu.overflow, cpu.negative, cpu.decimal, cpu.interrupt_disable)
+        if self.seen.get(start) == state:
+            self.park()
+        else:
+            self.seen[start] = state
+
+    def park(self) -> None:
+        # sleep until the soonest any device in the loop could change
+        timeout = self.MAX_PARK
+        fds = []
+        skip = None # cycles
+        stalled = True
+        for start in self.seen:
+            for component, addr in self.devices.get(start, ()):
+                seconds, fd = component.wakeup(addr)
+                if seconds is not None: timeout = min(timeout, seconds)
+                if fd is not None: fds.append(fd)
+                
+                cycles = component.wakeup_cycles(addr)
+                if cycles is not None:
+                    skip = cycles if skip is None else min(skip, cycles)
+                
+                if seconds is not None or fd is not None or cycles is not None:
+                    stalled = False
+        if stalled and self.stop_when_stalled:
+            raise Stalled(f"stalled at ${self.cpu.pc:04x}")
+        self.parks += 1
+        
+        # devices running on the cycle count can be skipped ahead to, with no
+        # need to wait at all when the cpu is unlimited
+        if skip is not None:
+            if self.hz is None:
+                self.cpu.cycles += skip
+                return
+            timeout = min(timeout, skip / self.hz)
+
+        began = time.perf_counter()
+        if self.deadline is not None:
+            if began >= self.deadline:
+                raise OutOfTime(f"out of time at ${self.cpu.pc:04x}")
+            timeout = min(timeout, self.deadline - began)
+        if timeout > 0:
+            if self.cooperative:
+                self.waiting = (began, timeout, fds, skip)
+                raise Parked(f"parked at ${self.cpu.pc:04x}")
+            if fds:
+                select.select(fds, [], [], timeout)
+            else:
+                time.sleep(timeout)
+
+        self.catch_up(began, skip)
+
+    def resume(self) -> None:
+        if self.waiting is None: return
+        began, _, _, skip = self.waiting
+        self.waiting = None
+        self.catch_up(began, skip)
+        # the loop has to go round again before it can be parked again, since
+        # it was parked before it could read anything
+        self.seen.clear()
+
+    def catch_up(self, began: float, skip: int | None) -> None:
+        # move the cycle count on by the time spent parked
+        if self.hz is not None:
+            cycles = int((time.perf_counter() - began) * self.hz)
+            if skip is not None: cycles = min(cycles, skip)
+            self.cpu.cycles += cycles
+
+    def forget(self, start: int) -> None:
+        self.devices.pop(start, None)
+        self.seen.pop(start, None)
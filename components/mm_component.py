@@ -1,9 +1,67 @@
 from abc import ABC, abstractmethod
 
 class MemoryMappedComponent(ABC):
+    # components whose reads have no side effects, and whose contents only
+    # change when the cpu writes to them, can have their code translated.
+    # 
+    # plain memory keeps its contents in `addresses` (covering `start` to
+    # `end`), which the cpu swaps for a view into its own flat memory so that
+    # it can skip calling fetch/write. writes are only made directly if the
+    # component is not `read_only`.
+    plain_memory = False
+    read_only = False
+    
+    # a busy-waiting cpu can be parked on components that are `idle_aware`,
+    # until `wakeup` says a read might give something new (see
+    # components/idle.py).
+    idle_aware = False
+    
     @abstractmethod
     def contains(self, addr: int) -> bool: ...
     @abstractmethod
     def fetch(self, addr: int) -> int: return 0
     @abstractmethod
-    def write(self, addr: int, val: int) -> None: pass
\ No newline at end of file
+    def write(self, addr: int, val: int) -> None: pass
+    
+    def attach(self, cpu) -> None:
+        # called when the component becomes part of a cpu, for components
+        # that need it (e.g. to read the cycle count)
+        pass
+    
+    def address_ranges(self) -> list[tuple[int, int]]:
+        # the (first, last) addresses of each run of addresses the component
+        # covers. components should override this, since working it out from
+        # `contains` means checking every address.
+        ranges = []
+        for addr in range(0x10000):
+            if not self.contains(addr): continue
+            if ranges and ranges[-1][1] == addr - 1:
+                ranges[-1] = (ranges[-1][0], addr)
+            else:
+                ranges.append((addr, addr))
+        return ranges
+    
+    def save_state(self) -> dict[str, bytes]:
+        # the component's state for a snapshot, as named sections, where ""
+        # is the main section. plain memory saves its contents, and other
+        # components should override this (and `load_state`) if they have
+        # state that the guest can see.
+        if self.plain_memory: return {"": bytes(self.addresses)}
+        return {}
+    
+    def load_state(self, sections: dict[str, memoryview]) -> None:
+        # restore what `save_state` saved. the cpu's state is restored first,
+        # so components can rely on its cycle count.
+        if self.plain_memory and "" in sections:
+            self.addresses[:] = sections[""]
+    
+    def wakeup(self, addr: int) -> tuple[float | None, int | None]:
+        # the seconds until a read from `addr` could return something new,
+        # and a file descriptor that becomes readable when it could. either
+        # can be None if there's no telling.
+        return None, None
+    
+    def wakeup_cycles(self, addr: int) -> int | None:
+        # for components that run on the cpu's cycle count rather than real
+        # time, the cycles until a read from `addr` could return something new
+        return None
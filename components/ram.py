@@ -1,15 +1,35 @@
-from random import randint
+import os
+import random
 from components.mm_component import MemoryMappedComponent
 
+def ram_fill(text: str) -> str | int:
+    # parse a ram fill mode given as text, where a seed is just a number
+    text = text.strip().lower()
+    if text in ("random", "zero"): return text
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise ValueError(f"'{text}' is not 'random', 'zero' or a seed")
+
 class Ram(MemoryMappedComponent):
-    def __init__(self, min_addr: int, max_addr: int) -> None:
+    plain_memory = True
+    
+    def __init__(self, min_addr: int, max_addr: int,
+                 fill: str | int = "random") -> None:
         self.start = min_addr
         self.end = max_addr
         
-        self.addresses = bytearray(self.end - self.start + 1)
-        
-        for i in range(len(self.addresses)):
-            self.addresses[i] = randint(0, 0xff)
+        # what the ram holds at power on: "random", "zero", or a seed for
+        # random contents that are the same every time
+        size = self.end - self.start + 1
+        if fill == "random":
+            self.addresses = bytearray(os.urandom(size))
+        elif fill == "zero":
+            self.addresses = bytearray(size)
+        elif isinstance(fill, int):
+            self.addresses = bytearray(random.Random(fill).randbytes(size))
+        else:
+            raise ValueError(f"'{fill}' is not a ram fill mode")
         
     def load(self, data: list[int], start_addr: int) -> None:
         addr = start_addr
@@ -21,6 +41,9 @@ class Ram(MemoryMappedComponent):
     def contains(self, addr: int) -> bool:
         return self.start <= addr <= self.end
     
+    def address_ranges(self) -> list[tuple[int, int]]:
+        return [(self.start, self.end)]
+    
     def fetch(self, addr: int) -> int:
         return self.addresses[addr - self.start] & 0xff
     
@@ -1,6 +1,9 @@
 from components.mm_component import MemoryMappedComponent
 
 class Rom(MemoryMappedComponent):
+    plain_memory = True
+    read_only = True
+    
     def __init__(self, min_addr: int, max_addr: int) -> None:
         self.start = min_addr
         self.end = max_addr
@@ -17,6 +20,9 @@ class Rom(MemoryMappedComponent):
     def contains(self, addr: int) -> bool:
         return self.start <= addr <= self.end
     
+    def address_ranges(self) -> list[tuple[int, int]]:
+        return [(self.start, self.end)]
+    
     def fetch(self, addr: int) -> int:
         return self.addresses[addr - self.start] & 0xff
     
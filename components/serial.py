@@ -1,54 +1,102 @@
-import sys
+import time
+import atexit
+import weakref
 
 from components.mm_component import MemoryMappedComponent
+from components.transports import Transport, WINDOWS, get_stdio
 
-if sys.platform.startswith("win"):
-    import msvcrt
+# every port that's still around, so that what they hold is sent on exit. a
+# port is let go of once nothing else refers to it.
+ports: weakref.WeakSet["SerialPort"] = weakref.WeakSet()
 
-    def getch():
-        if msvcrt.kbhit():
-            c = msvcrt.getwch()
-            if c == '\r': c = '\n'
-            return c
-        return None
-
-else:
-    import select
-    import tty
-    import termios
-
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
-    tty.setcbreak(fd)
-
-    def getch():
-        dr, dw, de = select.select([sys.stdin], [], [], 0)
-        if dr:
-            return sys.stdin.read(1)
-        return None
-
-    import atexit
-    
-    atexit.register(lambda: termios.tcsetattr(fd, termios.TCSADRAIN, old_settings))
+@atexit.register
+def flush_all() -> None:
+    for port in list(ports): port.flush()
 
 class SerialPort(MemoryMappedComponent):
-    def __init__(self, addr: int) -> None:
+    """
+    The SerialPort sends and receives single bytes through a transport (see
+    components/transports.py), which is the terminal by default.
+    
+    The console port (serial device 00) is connected to a terminal, and
+    writing 0x11 to it clears the screen. Misc ports (serial devices 06-ff)
+    pass every byte through as-is, for printers and the like.
+    
+    Output is buffered rather than sent a byte at a time. The buffer is
+    flushed once it holds `flush_bytes` bytes, once the oldest byte in it has
+    waited `flush_after` seconds, and before every read (since the guest is
+    probably waiting on the other end). The console also flushes on a newline
+    or clear screen. `tick` should be called regularly, so the deadline is
+    kept even if the guest stops writing.
+    """
+    
+    # a read only gives something new once a byte arrives, which can only be
+    # waited on outside of windows
+    idle_aware = not WINDOWS
+    
+    def __init__(self, addr: int, transport: Transport | None = None,
+                 console: bool = True, flush_bytes: int = 4096,
+                 flush_after: float = 0.02) -> None:
         self.addr = addr
+        self.transport = get_stdio() if transport is None else transport
+        self.console = console
+        
+        self.flush_bytes = flush_bytes
+        self.flush_after = flush_after
+        
+        self.output = bytearray()
+        self.deadline = 0.0
+        ports.add(self)
         
     def contains(self, addr: int) -> bool:
         return addr == self.addr
     
+    def address_ranges(self) -> list[tuple[int, int]]:
+        return [(self.addr, self.addr)]
+    
     def fetch(self, addr: int) -> int:
+        if self.output: self.flush()
+        
         # the assumption here is that a nul byte will never be typed directly,
         # as they will not be registered by software
-        key = getch()
-        key = ord(key) if key is not None else 0
-        return key & 0xff
+        received = self.transport.received
+        return received.popleft() if received else 0
     
     def write(self, addr: int, val: int) -> None:
-        if val == 0x11: # ascii device control 1:
-            sys.stdout.write("\033[2J\033[H")
+        if not self.output:
+            self.deadline = time.monotonic() + self.flush_after
+        
+        if val == 0x11 and self.console: # ascii device control 1:
+            self.output += b"\033[2J\033[H"
+        else:
+            self.output.append(val)
+            
+        if len(self.output) >= self.flush_bytes or \
+            (self.console and (val == 0x0a or val == 0x11)):
+            self.flush()
         else:
-            sys.stdout.write(chr(val))
+            self.tick()
+            
+    def tick(self) -> None:
+        if self.output and time.monotonic() >= self.deadline: self.flush()
             
-        sys.stdout.flush()
\ No newline at end of file
+    def flush(self) -> None:
+        if not self.output: return
+        self.transport.send(bytes(self.output))
+        self.output.clear()
+
+    def close(self) -> None:
+        # send what's left, and let go of the transport
+        self.flush()
+        ports.discard(self)
+        self.transport.close()
+        
+    def save_state(self) -> dict[str, bytes]:
+        # output written before the snapshot belongs before it
+        self.flush()
+        return {}
+        
+    def wakeup(self, addr: int) -> tuple[float | None, int | None]:
+        self.transport.clear_wakeup()
+        if self.transport.received: return 0.0, None
+        return None, self.transport.wake_fd
@@ -0,0 +1,80 @@
+import os
+import mmap
+import zlib
+import struct
+from collections.abc import Container
+
+# a snapshot is a file of named sections, each holding the saved state of one
+# part of the machine (see `Cpu.save_state`):
+#
+#   magic "OZPXSNAP", version (u16), section count (u16)
+#   for each section:
+#       name length (u8), name (ascii), flags (u8), size (u32), data
+#
+# sections are compressed with zlib, unless they are stored raw (flag 0). raw
+# sections are read straight out of a mapping of the file, so large ones (ram
+# and disks) can be restored without being copied or decompressed first.
+
+MAGIC = b"OZPXSNAP"
+VERSION = 1
+
+COMPRESSED = 1 << 0
+
+HEADER = struct.Struct("<8sHH")
+SECTION = struct.Struct("<BI")
+
+def write_snapshot(path: str, sections: dict[str, bytes],
+                   compress: bool = True, raw: Container[str] = ()) -> None:
+    # sections named in `raw` are stored raw even when compressing
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(sections)))
+        for name, data in sections.items():
+            flags = 0
+            if compress and name not in raw:
+                data = zlib.compress(data, 1)
+                flags |= COMPRESSED
+
+            encoded = name.encode("ascii")
+            f.write(bytes([len(encoded)]) + encoded)
+            f.write(SECTION.pack(flags, len(data)))
+            f.write(data)
+
+def read_snapshot(path: str) -> dict[str, memoryview]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise ValueError(f"'{path}' is cut short")
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"'{path}' is not a snapshot")
+    if version != VERSION:
+        raise ValueError(f"'{path}' is a version {version} snapshot, "
+                         f"only version {VERSION} is supported")
+
+    sections = {}
+    offset = HEADER.size
+    try:
+        for _ in range(count):
+            name_size = data[offset]
+            name = bytes(data[offset + 1:offset + 1 + name_size])
+            name = name.decode("ascii")
+            offset += 1 + name_size
+
+            flags, size = SECTION.unpack_from(data, offset)
+            offset += SECTION.size
+            section = data[offset:offset + size]
+            offset += size
+            if len(section) < size:
+                raise ValueError(f"'{path}' is cut short")
+
+            if flags & COMPRESSED:
+                section = memoryview(zlib.decompress(section))
+            sections[name] = section
+    except (IndexError, struct.error):
+        # ran off the end in the middle of a section's header
+        raise ValueError(f"'{path}' is cut short") from None
+    except zlib.error:
+        raise ValueError(f"'{path}' is corrupt") from None
+
+    return sections
@@ -1,6 +1,7 @@
 from components.mm_component import MemoryMappedComponent
 
 import time
+import struct
 
 def break_word(word: int) -> tuple[int, int]:
     low = word & 0xff
@@ -25,21 +26,45 @@ class Timer(MemoryMappedComponent):
     b:
         - write to set milliseconds per 1 unit in time readout
         - read time elapsed since the last write to a (high byte)
+    
+    By default, the Timer measures real time. Given `virtual_hz`, it measures
+    the time the cpu would have taken to execute its cycles at that clock
+    rate instead, which makes reading it nearly free and the guest's timing
+    repeatable, and lets it run faster than real time when unthrottled.
     """
     
-    def __init__(self, reg_a: int, reg_b: int) -> None:
+    idle_aware = True
+    
+    def __init__(self, reg_a: int, reg_b: int,
+                 virtual_hz: int | None = None) -> None:
         self.reg_a = reg_a
         self.reg_b = reg_b
+        self.virtual_hz = virtual_hz
+        self.cpu = None
         
-        self.begin = 0
+        self.begin = 0 # seconds, or cycles in virtual time
         self.resolution = 1 # ms per tick
         
+    def attach(self, cpu) -> None:
+        self.cpu = cpu
+        
+    def now(self) -> float | int:
+        if self.virtual_hz is None: return time.monotonic()
+        return self.cpu.cycles
+    
+    def elapsed_ms(self) -> float:
+        if self.virtual_hz is None:
+            return (time.monotonic() - self.begin) * 1000
+        return (self.cpu.cycles - self.begin) * 1000 / self.virtual_hz
+        
     def contains(self, addr: int) -> bool:
-        return addr in [self.reg_a, self.reg_b]
+        return addr == self.reg_a or addr == self.reg_b
+    
+    def address_ranges(self) -> list[tuple[int, int]]:
+        return [(self.reg_a, self.reg_a), (self.reg_b, self.reg_b)]
     
     def fetch(self, addr: int) -> int:
-        elapsed = (time.monotonic() - self.begin) * 1000 // self.resolution
-        elapsed = int(elapsed) & 0xffff
+        elapsed = int(self.elapsed_ms() // self.resolution) & 0xffff
         
         if addr == self.reg_a:
             return break_word(elapsed)[1]
@@ -48,6 +73,32 @@ class Timer(MemoryMappedComponent):
     
     def write(self, addr: int, val: int) -> None:
         if addr == self.reg_a:
-            self.begin = time.monotonic()
+            self.begin = self.now()
         elif addr == self.reg_b:
-            self.resolution = max(1, val) # prevent div by 0
\ No newline at end of file
+            self.resolution = max(1, val) # prevent div by 0
+            
+    def next_tick_ms(self) -> int:
+        # both registers change when the readout ticks over
+        return (int(self.elapsed_ms() // self.resolution) + 1) * \
+            self.resolution
+            
+    def save_state(self) -> dict[str, bytes]:
+        # the start is saved relative to now, so the timer carries on from
+        # where it was, whenever the snapshot is restored
+        return {"": struct.pack("<dI", self.now() - self.begin,
+                                self.resolution)}
+    
+    def load_state(self, sections: dict[str, memoryview]) -> None:
+        elapsed, self.resolution = struct.unpack("<dI", sections[""])
+        self.begin = self.now() - elapsed
+        if self.virtual_hz is not None: self.begin = int(self.begin)
+            
+    def wakeup(self, addr: int) -> tuple[float | None, int | None]:
+        if self.virtual_hz is not None: return None, None
+        tick = self.next_tick_ms() / 1000
+        return max(0.0, self.begin + tick - time.monotonic()), None
+    
+    def wakeup_cycles(self, addr: int) -> int | None:
+        if self.virtual_hz is None: return None
+        tick = self.begin - (-self.next_tick_ms() * self.virtual_hz // 1000)
+        return max(0, tick - self.cpu.cycles)
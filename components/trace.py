@@ -0,0 +1,96 @@
+import struct
+from collections.abc import Iterator
+
+# a trace records every instruction the cpu runs, in a ring buffer holding the
+# last `depth` of them, so that what led up to a crash can be dumped to a file
+# and looked at afterwards (see tracedump.py).
+#
+# a trace file is a header, followed by the records from oldest to newest:
+#
+#   magic "OZPXTRCE", version (u16), record size (u16), records (u32),
+#   instructions traced in total (u64)
+
+MAGIC = b"OZPXTRCE"
+VERSION = 1
+
+HEADER = struct.Struct("<8sHHIQ")
+# pc, opcode, a, x, y, sp, status, effective address (or immediate operand),
+# all from just before the instruction ran
+RECORD = struct.Struct("<HBBBBBBH")
+
+class Trace:
+    """
+    A Trace is a ring buffer of the last `depth` instructions run by a cpu,
+    which is preallocated so that recording an instruction only packs a few
+    bytes into it. It is given to a cpu with `Cpu.set_trace`.
+
+    Instructions run one at a time (rather than in a translated block) are
+    traced too, including opcodes that aren't implemented.
+    """
+
+    def __init__(self, depth: int = 65536) -> None:
+        self.depth = max(1, depth)
+        self.records = bytearray(self.depth * RECORD.size)
+        self.record = None
+        self.position = lambda: (0, 0)
+
+    def attach(self, cpu) -> None:
+        # `record` is called for every instruction, so it is a closure over
+        # everything it needs, which is quicker to get at than attributes.
+        # the status byte is packed inline for the same reason.
+        records = self.records
+        pack = RECORD.pack_into
+        size = RECORD.size
+        end = len(records)
+        offset = 0 # of the next record
+        count = 0 # instructions traced, ever
+
+        def record(pc: int, opcode: int, addr: int) -> None:
+            nonlocal offset, count
+            pack(records, offset, pc & 0xffff, opcode, cpu.ra, cpu.rx,
+                 cpu.ry, cpu.sp, cpu.carry | cpu.zero << 1 |
+                 cpu.interrupt_disable << 2 | cpu.decimal << 3 | 0x20 |
+                 cpu.overflow << 6 | cpu.negative << 7, addr & 0xffff)
+            offset += size
+            if offset == end: offset = 0
+            count += 1
+
+        self.record = record
+        self.position = lambda: (offset, count)
+
+    @property
+    def count(self) -> int:
+        return self.position()[1]
+
+    def recent(self) -> bytes:
+        # every record still in the buffer, oldest first
+        offset, count = self.position()
+        if count < self.depth: return bytes(self.records[:offset])
+        return bytes(self.records[offset:] + self.records[:offset])
+
+    def dump(self, path: str) -> None:
+        records = self.recent()
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size,
+                                len(records) // RECORD.size, self.count))
+            f.write(records)
+
+def read_trace(path: str) -> tuple[int, Iterator[tuple[int, ...]]]:
+    # the number of instructions traced in total, and the records in a trace
+    # file, oldest first
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise ValueError(f"'{path}' is cut short")
+    magic, version, size, records, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"'{path}' is not a trace")
+    if version != VERSION or size != RECORD.size:
+        raise ValueError(f"'{path}' is a version {version} trace, "
+                         f"only version {VERSION} is supported")
+
+    body = memoryview(data)[HEADER.size:HEADER.size + records * size]
+    if len(body) < records * size:
+        raise ValueError(f"'{path}' is cut short")
+    return count, RECORD.iter_unpack(body)
@@ -0,0 +1,305 @@
+import re
+from collections.abc import Callable
+
+from components.dispatch import INSTRUCTIONS, instruction_source, indent, \
+    inline_memory_access, namespace, operand_access, trace_source, \
+    PAGE_PENALTY, PAGE_CROSS
+from components.idle import IDLE_INSTRUCTIONS, IDLE_ADDR_MODES
+
+# straight-line runs of guest code ("blocks") are translated into a single
+# python function each, with operands that were read ahead of time folded into
+# the source as constants. a block ends at the first instruction that can
+# change the flow of control, and returns the number of instructions it ran.
+#
+# an instruction's cycles count once it has finished. a block adds them to
+# `cpu.cycles` in bulk: before any instruction that reads or writes a device at
+# a known address (so devices see an exact count), before anything that can
+# raise, and when the block returns.
+
+MAX_BLOCK_LENGTH = 64
+
+OPERAND_SIZES: dict[str | None, int] = {
+    None: 0,
+    "addr_accumulator": 0,
+    "addr_immediate": 1,
+    "addr_relative": 1,
+    "addr_zero_page": 1,
+    "addr_zero_page_x": 1,
+    "addr_zero_page_y": 1,
+    "addr_absolute": 2,
+    "addr_absolute_x": 2,
+    "addr_absolute_y": 2,
+    "addr_indexed_indirect": 1,
+    "addr_indirect_indexed": 1,
+    "addr_indirect": 2,
+}
+
+# addressing modes with their operand already known. `{byte}` and `{word}` are
+# the operand and `{target}` is the destination of a relative branch.
+STATIC_ADDR_MODES: dict[str | None, str] = {
+    None: "",
+    "addr_accumulator": "",
+    "addr_immediate": "",
+    "addr_relative": "addr = {target}",
+    "addr_zero_page": "addr = {byte}",
+    "addr_zero_page_x": "addr = ({byte} + cpu.rx) & 0xff",
+    "addr_zero_page_y": "addr = ({byte} + cpu.ry) & 0xff",
+    "addr_absolute": "addr = {word}",
+    "addr_absolute_x": "base = {word}\naddr = (base + cpu.rx) & 0xffff",
+    "addr_absolute_y": "base = {word}\naddr = (base + cpu.ry) & 0xffff",
+    "addr_indexed_indirect": "ptr = ({byte} + cpu.rx) & 0xff\n"
+                             "addr = fetch(ptr) | fetch((ptr + 1) & 0xff) << 8",
+    "addr_indirect_indexed": "base = fetch({byte}) | fetch(({byte} + 1) & 0xff) << 8\n"
+                             "addr = (base + cpu.ry) & 0xffff",
+    "addr_indirect": "addr = fetch({word}) | fetch({word} + 1) << 8",
+}
+
+CONTROL_FLOW = {
+    "jmp", "jsr", "rts",
+    "beq", "bne", "bcs", "bcc", "bvs", "bvc", "bmi", "bpl",
+}
+
+STACK_WRITES = {"jsr", "pha", "php"}
+
+def write_range(instr: str, mode: str | None, operand: int) -> tuple[int, int] | None:
+    # the lowest and highest addresses an instruction could write to
+    if instr in STACK_WRITES: return 0x0100, 0x01ff
+    if "{store}" not in INSTRUCTIONS.get(instr, ""): return None
+
+    if mode == "addr_accumulator": return None
+    if mode in ("addr_zero_page", "addr_absolute"): return operand, operand
+    if mode in ("addr_zero_page_x", "addr_zero_page_y"): return 0x0000, 0x00ff
+    if mode in ("addr_absolute_x", "addr_absolute_y") and operand <= 0xff00:
+        return operand, operand + 0xff
+    return 0x0000, 0xffff
+
+# (address, opcode, instruction, addressing mode, operand, cycles, penalty)
+Instruction = tuple[int, int, str, str | None, int, int, int]
+
+def next_address(instr: Instruction) -> int:
+    return instr[0] + 1 + OPERAND_SIZES[instr[3]]
+
+def block_end(instrs: list[Instruction]) -> int:
+    return next_address(instrs[-1])
+
+def uses_pc(source: str) -> bool:
+    return re.search(r"(?<![\w.])pc\b", source) is not None
+
+class Translator:
+    def __init__(self, cpu) -> None:
+        self.cpu = cpu
+
+        # block start address -> compiled block
+        self.blocks: dict[int, Callable[[], int]] = {}
+        # block start address -> (first address, last address + 1)
+        self.extents: dict[int, tuple[int, int]] = {}
+        # page -> start addresses of the blocks containing code on that page
+        self.pages: list[set[int]] = [set() for _ in range(256)]
+
+        self.namespace = namespace(cpu)
+        self.namespace["idle"] = cpu.idle
+        
+        # writes to plain memory pages holding blocks go through this, so the
+        # blocks can be dropped when their code changes
+        self.write_hook = self.write_code
+
+    def is_plain(self, addr: int) -> bool:
+        return addr <= 0xffff and self.cpu.fetch_handlers[addr >> 8] is None
+    
+    def static_access(self, instr: Instruction) -> dict[str, str]:
+        # read operands at an address known ahead of time straight from the
+        # right place, rather than checking the page table on every read
+        _, _, _, mode, operand, _, _ = instr
+        access = operand_access(mode)
+        
+        if mode == "addr_immediate":
+            access["load"] = f"0x{operand:02x}"
+        elif mode in ("addr_zero_page", "addr_absolute"):
+            if self.is_plain(operand):
+                access["load"] = f"mem[0x{operand:04x}]"
+            else:
+                access["load"] = f"rd[0x{operand >> 8:02x}](0x{operand:04x})"
+        elif mode == "addr_relative":
+            target = (next_address(instr) + (operand ^ 0x80) - 0x80) & 0xffff
+            crossed = (next_address(instr) ^ target) & 0xff00
+            access["taken"] = "2" if crossed else "1"
+            
+        return access
+    
+    def touches_device(self, instr: Instruction) -> bool:
+        _, _, _, mode, operand, _, _ = instr
+        return mode in ("addr_zero_page", "addr_absolute") and \
+            not self.is_plain(operand)
+
+    def idle_devices(self, instrs: list[Instruction]) -> list | None:
+        # the devices read by a block that could be part of an idle loop, or
+        # None if it can't be (see components/idle.py)
+        devices = []
+        for _, _, name, mode, operand, _, _ in instrs:
+            if name not in IDLE_INSTRUCTIONS or mode not in IDLE_ADDR_MODES:
+                return None
+            if mode not in ("addr_zero_page", "addr_absolute") or \
+                "{load}" not in INSTRUCTIONS[name] or self.is_plain(operand):
+                continue
+            
+            component = self.cpu.mm_component_map[operand]
+            if component is None or not component.idle_aware: return None
+            devices.append((component, operand))
+            
+        return devices
+
+    def decode_block(self, start: int) -> list[Instruction]:
+        instrs = []
+        pc = start
+
+        while len(instrs) < MAX_BLOCK_LENGTH:
+            if not self.is_plain(pc): break
+            opcode = self.cpu.fetch(pc)
+            if opcode not in self.cpu.isa.opcodes: break
+            instr_func, mode_func, cycles, penalty = self.cpu.isa.opcodes[opcode]
+            instr = instr_func.__name__
+            mode = None if mode_func is None else mode_func.__name__
+
+            size = OPERAND_SIZES[mode]
+            if not all(self.is_plain(pc + 1 + i) for i in range(size)): break
+            operand = 0
+            for i in range(size):
+                operand |= self.cpu.fetch(pc + 1 + i) << (8 * i)
+
+            instrs.append((pc, opcode, instr, mode, operand, cycles, penalty))
+            pc += 1 + size
+
+            # instructions that are not compiled inline are treated as jumps,
+            # since there is no telling what the `Isa` method will do
+            if instr in CONTROL_FLOW or instr not in INSTRUCTIONS: break
+
+        if not instrs: return instrs
+
+        # a store to a known address inside the block modifies code that is
+        # still to run, so the block has to end there to see the change
+        end = block_end(instrs)
+        for i, (_, _, instr, mode, operand, _, _) in enumerate(instrs):
+            span = write_range(instr, mode, operand)
+            if span is None or span[0] != span[1]: continue
+            if next_address(instrs[i]) <= span[0] < end:
+                del instrs[i + 1:]
+                break
+
+        return instrs
+
+    def block_source(self, start: int, instrs: list[Instruction],
+                     idle: bool = False) -> str:
+        end = block_end(instrs)
+        lines = [f"def block_{start:04x}():"]
+        if idle: lines.append(f"    idle.enter(0x{start:04x})")
+        pending = 0 # cycles not yet added to the count
+
+        def add_cycles(pad: str = "    ") -> None:
+            if pending: lines.append(f"{pad}cpu.cycles += {pending}")
+
+        for count, instr in enumerate(instrs, 1):
+            pc, opcode, name, mode, operand, cycles, penalty = instr
+            next_pc = next_address(instr)
+            target = (next_pc + (operand ^ 0x80) - 0x80) & 0xffff
+
+            setup = STATIC_ADDR_MODES[mode].format(
+                byte=f"0x{operand:02x}",
+                word=f"0x{operand:04x}",
+                target=f"0x{target:04x}",
+            )
+            body = instruction_source(name, mode, opcode, self.static_access(instr))
+
+            lines.append(f"    # ${pc:04x}: {name}")
+            if self.touches_device(instr) or "raise" in body or \
+                name not in INSTRUCTIONS:
+                # if this raises, the cpu is left on this instruction, as it
+                # would be running one instruction at a time
+                add_cycles()
+                pending = 0
+                if count > 1: lines.append(f"    cpu.pc = 0x{pc:04x}")
+            pending += cycles
+            
+            if uses_pc(setup + "\n" + body):
+                lines.append(f"    pc = 0x{next_pc:04x}")
+            if setup: lines.append(indent(setup))
+            if self.cpu.trace is not None:
+                lines.append(indent(trace_source(
+                    f"0x{pc:04x}", opcode, mode, f"0x{operand:02x}")))
+            lines.append(indent(body))
+            if penalty == PAGE_PENALTY: lines.append(indent(PAGE_CROSS))
+
+            # a store to an address only known at runtime might still land on
+            # the rest of this block
+            span = write_range(name, mode, operand)
+            if span is not None and count < len(instrs) and \
+                span[0] < end and next_pc <= span[1]:
+                written = "addr" if name not in STACK_WRITES else "(0x100 | sp)"
+                lines.append(f"    if 0x{next_pc:04x} <= {written} < 0x{end:04x}:")
+                add_cycles("        ")
+                lines.append(f"        cpu.pc = 0x{next_pc:04x}")
+                lines.append(f"        return {count}")
+
+        add_cycles()
+        if idle: lines.append("    idle.exit = cpu.cycles")
+        last = instrs[-1][2]
+        if last in CONTROL_FLOW or last not in INSTRUCTIONS:
+            lines.append("    cpu.pc = pc")
+        else:
+            lines.append(f"    cpu.pc = 0x{end & 0xffff:04x}")
+        lines.append(f"    return {len(instrs)}")
+
+        return "\n".join(lines)
+
+    def step(self) -> int:
+        self.cpu.execute()
+        return 1
+
+    def translate(self, start: int) -> Callable[[], int]:
+        instrs = self.decode_block(start)
+
+        # code that can't be translated runs one instruction at a time
+        if not instrs: return self.step
+
+        devices = self.idle_devices(instrs)
+        idle = devices is not None
+        source = inline_memory_access(self.block_source(start, instrs, idle))
+        exec(compile(source, f"<block ${start:04x}>", "exec"), self.namespace)
+        block = self.namespace.pop(f"block_{start:04x}")
+
+        end = block_end(instrs)
+        self.blocks[start] = block
+        self.extents[start] = (start, end)
+        if idle: self.cpu.idle.devices[start] = devices
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            self.pages[page].add(start)
+            if self.cpu.write_handlers[page] is None:
+                self.cpu.write_handlers[page] = self.write_hook
+
+        return block
+    
+    def write_code(self, addr: int, val: int) -> None:
+        self.cpu.memory[addr] = val & 0xff
+        self.invalidate(addr)
+
+    def invalidate(self, addr: int) -> None:
+        # drop every block containing `addr`, after the cpu wrote to it
+        for start in list(self.pages[addr >> 8]):
+            first, end = self.extents[start]
+            if first <= addr < end:
+                self.discard(start)
+
+    def discard(self, start: int) -> None:
+        first, end = self.extents.pop(start)
+        del self.blocks[start]
+        self.cpu.idle.forget(start)
+        for page in range(first >> 8, ((end - 1) >> 8) + 1):
+            self.pages[page].discard(start)
+            if not self.pages[page] and \
+                self.cpu.write_handlers[page] is self.write_hook:
+                self.cpu.write_handlers[page] = None
+
+    def flush(self) -> None:
+        # drop every block, after memory was changed without going through
+        # the cpu (e.g. loading data directly into a component)
+        for start in list(self.blocks):
+            self.discard(start)
@@ -0,0 +1,444 @@
+import os
+import sys
+import stat
+import codecs
+import atexit
+import threading
+from collections import deque
+from collections.abc import Callable
+
+# a transport connects a serial port to something outside the emulator: the
+# terminal, a pty, a socket or a file. every transport in the process is
+# serviced by one background thread (the `IoLoop`), which pushes whatever it
+# receives into the transport's ring buffer. sending happens straight away,
+# on the cpu's thread, since the serial port already batches its output.
+#
+# nothing here touches the terminal, or starts a thread, until a transport
+# that needs it is opened (or, for the terminal, attached), so that machines
+# can be created in processes without a terminal. modules only some transports
+# need are imported by them.
+
+WINDOWS = sys.platform.startswith("win")
+
+class IoLoop:
+    """
+    The IoLoop waits for input on every transport at once, with a selector,
+    on a single background thread.
+
+    Changes to what the loop is waiting on are queued up and made by the loop
+    itself, which is woken up through a socket pair to pick them up (a pipe
+    can't be selected on windows).
+    """
+
+    def __init__(self) -> None:
+        import socket
+        import selectors
+        self.selector = selectors.DefaultSelector()
+        self.changes: deque[Callable[[], None]] = deque()
+
+        self.wake, self.waker = socket.socketpair()
+        self.wake.setblocking(False)
+        self.waker.setblocking(False)
+        self.selector.register(self.wake, selectors.EVENT_READ, None)
+
+        threading.Thread(target=self.run, name="serial io", daemon=True).start()
+
+    def run(self) -> None:
+        while True:
+            for key, _ in self.selector.select():
+                try:
+                    if key.data is None: self.wake.recv(1024)
+                    else: key.data()
+                except OSError:
+                    pass
+            while self.changes:
+                try:
+                    self.changes.popleft()()
+                except (OSError, ValueError, KeyError):
+                    pass
+
+    def change(self, change: Callable[[], None]) -> None:
+        self.changes.append(change)
+        try:
+            self.waker.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def watch(self, fd: int, callback: Callable[[], None]) -> None:
+        # call `callback` on the loop's thread whenever `fd` is readable
+        import selectors
+        self.change(lambda: self.selector.register(
+            fd, selectors.EVENT_READ, callback))
+
+    def unwatch(self, fd: int,
+                then: Callable[[], None] | None = None) -> None:
+        # stop watching `fd`, and then call `then` (e.g. to close it, which
+        # has to wait until the loop is done with it)
+        def unregister() -> None:
+            try:
+                self.selector.unregister(fd)
+            except (KeyError, ValueError):
+                pass
+            if then is not None: then()
+        self.change(unregister)
+
+io_loop: IoLoop | None = None
+
+def get_io_loop() -> IoLoop:
+    global io_loop
+    if io_loop is None: io_loop = IoLoop()
+    return io_loop
+
+def signal(fd: int) -> None:
+    # wake up anything selecting on the other end of a pipe. if the pipe is
+    # full, it's already awake.
+    try:
+        os.write(fd, b"\0")
+    except BlockingIOError:
+        pass
+
+def drain(fd: int) -> None:
+    try:
+        while os.read(fd, 1024): pass
+    except BlockingIOError:
+        pass
+
+class Transport:
+    """
+    A Transport carries bytes between a serial port and the outside world.
+
+    Received bytes are put in `received`, a ring buffer holding the newest
+    `BUFFER_SIZE` bytes. Whenever bytes arrive, `available` is set and
+    `wake_fd` becomes readable, until `clear_wakeup` is called, so that an
+    idle cpu can wait for them. `wake_fd` is only opened by transports that
+    go on receiving once they're open (and never on windows), and is None
+    otherwise.
+
+    `close` lets go of everything the transport has open.
+    """
+
+    BUFFER_SIZE = 4096
+
+    def __init__(self) -> None:
+        self.received: deque[int] = deque(maxlen=self.BUFFER_SIZE)
+        self.available = threading.Event()
+
+        self.wake_fd = None
+
+    def open_wakeup(self) -> None:
+        # called before watching for input, so that it can be waited on
+        if WINDOWS or self.wake_fd is not None: return
+        self.wake_fd, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_fd, False)
+        os.set_blocking(self.wake_write, False)
+
+    def close(self) -> None:
+        if self.wake_fd is None: return
+        wake_fd, self.wake_fd = self.wake_fd, None
+        os.close(wake_fd)
+        os.close(self.wake_write)
+
+    def describe(self) -> str:
+        return type(self).__name__
+
+    def receive(self, data: bytes) -> None:
+        if not data: return
+        self.received.extend(data)
+        self.available.set()
+        if self.wake_fd is not None: signal(self.wake_write)
+
+    def clear_wakeup(self) -> None:
+        # forget about bytes that were already seen. bytes arriving after this
+        # will set off the wakeup again.
+        self.available.clear()
+        if self.wake_fd is not None: drain(self.wake_fd)
+
+    def send(self, data: bytes) -> None:
+        pass
+
+class NullTransport(Transport):
+    # nothing connected: output is dropped, and nothing is ever received
+    def describe(self) -> str:
+        return "nothing"
+
+class StdioTransport(Transport):
+    """
+    The StdioTransport is the terminal the emulator is running in. Keys are
+    decoded as text, and each character is received as one byte.
+
+    Until `attach` is called, output still goes to stdout, but stdin is left
+    alone. Attaching starts reading keys, and on linux & mac, puts the
+    terminal into cbreak mode (keys are sent as soon as they're pressed)
+    until the emulator exits.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.decoder = codecs.getincrementaldecoder(
+            sys.stdin.encoding or "utf-8")(errors="replace")
+        self.attached = False
+        
+    def attach(self) -> None:
+        if self.attached: return
+        self.attached = True
+        
+        if WINDOWS:
+            threading.Thread(target=self.read_console, name="keys",
+                             daemon=True).start()
+            return
+
+        self.fd = sys.stdin.fileno()
+        if stat.S_ISREG(os.fstat(self.fd).st_mode):
+            # a file can't be waited on, but it's all there already
+            self.receive_text(sys.stdin.read())
+            return
+        if os.isatty(self.fd):
+            import tty
+            import termios
+            old_settings = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+            atexit.register(lambda: termios.tcsetattr(
+                self.fd, termios.TCSADRAIN, old_settings))
+
+        self.open_wakeup()
+        get_io_loop().watch(self.fd, self.read)
+
+    def close(self) -> None:
+        # the terminal is shared by every port on stdio, and lasts as long as
+        # the emulator does
+        pass
+
+    def describe(self) -> str:
+        return "the terminal"
+
+    def receive_text(self, text: str) -> None:
+        self.receive(bytes(ord(c) & 0xff for c in text))
+
+    def read(self) -> None:
+        data = os.read(self.fd, 1024)
+        if not data:
+            # stdin was closed
+            get_io_loop().unwatch(self.fd)
+            return
+        self.receive_text(self.decoder.decode(data))
+
+    def read_console(self) -> None:
+        import msvcrt
+        while True:
+            c = msvcrt.getwch()
+            if c == '\r': c = '\n'
+            self.receive_text(c)
+
+    def send(self, data: bytes) -> None:
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+# there is only one terminal, so every serial port on stdio shares it
+stdio: StdioTransport | None = None
+
+def get_stdio() -> StdioTransport:
+    global stdio
+    if stdio is None: stdio = StdioTransport()
+    return stdio
+
+def attach_terminal() -> None:
+    # start using the terminal for input, if any serial port is on stdio
+    if stdio is not None: stdio.attach()
+
+class PtyTransport(Transport):
+    """
+    The PtyTransport creates a new pseudo-terminal (linux & mac only), which
+    a terminal program like `screen` or `minicom` can be connected to. It
+    passes bytes through untouched.
+
+    Output is dropped while nothing is reading it, rather than stalling the
+    emulator.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.name = os.ttyname(self.slave)
+
+        self.open_wakeup()
+        get_io_loop().watch(self.master, self.read)
+
+    def describe(self) -> str:
+        return self.name
+
+    def close(self) -> None:
+        super().close()
+        master, slave = self.master, self.slave
+        def close_pty() -> None:
+            os.close(master)
+            os.close(slave)
+        get_io_loop().unwatch(master, close_pty)
+
+    def read(self) -> None:
+        try:
+            self.receive(os.read(self.master, 1024))
+        except (BlockingIOError, OSError):
+            pass
+
+    def send(self, data: bytes) -> None:
+        try:
+            os.write(self.master, data)
+        except (BlockingIOError, OSError):
+            pass
+
+class SocketTransport(Transport):
+    """
+    The SocketTransport listens on a unix domain socket or a tcp port on
+    localhost, and talks to one client at a time. A new client takes over
+    from the last one.
+
+    Output is dropped while no client is connected.
+    """
+
+    def __init__(self, family: int, address: str | tuple[str, int]) -> None:
+        import socket
+        super().__init__()
+        self.address = address
+        self.client = None
+
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        elif os.path.exists(address):
+            os.unlink(address)
+        self.server.bind(address)
+        self.server.listen()
+
+        self.open_wakeup()
+        get_io_loop().watch(self.server.fileno(), self.accept)
+
+    def describe(self) -> str:
+        if isinstance(self.address, str): return self.address
+        return f"{self.address[0]}:{self.address[1]}"
+
+    def close(self) -> None:
+        super().close()
+        self.disconnect()
+        get_io_loop().unwatch(self.server.fileno(), self.server.close)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def accept(self) -> None:
+        client, _ = self.server.accept()
+        self.disconnect()
+        self.client = client
+        get_io_loop().watch(client.fileno(), self.read)
+
+    def disconnect(self) -> None:
+        if self.client is None: return
+        get_io_loop().unwatch(self.client.fileno())
+        self.client.close()
+        self.client = None
+
+    def read(self) -> None:
+        try:
+            data = self.client.recv(1024)
+        except OSError:
+            data = b""
+        if not data:
+            self.disconnect()
+        self.receive(data)
+
+    def send(self, data: bytes) -> None:
+        client = self.client
+        if client is None: return
+        try:
+            client.sendall(data)
+        except OSError:
+            pass
+
+class FileTransport(Transport):
+    """
+    The FileTransport appends output to a file (or named pipe), and reads
+    input from another. A regular input file is received all at once, and a
+    named pipe as data is written to it, by any number of writers in turn.
+    """
+
+    def __init__(self, out_path: str, in_path: str | None = None) -> None:
+        super().__init__()
+        self.out_path = out_path
+        self.out = open(out_path, "ab", buffering=0)
+        self.fd = None
+
+        if in_path is None: return
+        if stat.S_ISFIFO(os.stat(in_path).st_mode):
+            # opening for writing too means the pipe never reaches the end,
+            # even with no writers
+            self.fd = os.open(in_path, os.O_RDWR | os.O_NONBLOCK)
+            self.open_wakeup()
+            get_io_loop().watch(self.fd, self.read)
+        else:
+            with open(in_path, "rb") as f:
+                self.receive(f.read())
+
+    def describe(self) -> str:
+        return self.out_path
+
+    def close(self) -> None:
+        super().close()
+        self.out.close()
+        if self.fd is not None:
+            get_io_loop().unwatch(self.fd, lambda: os.close(self.fd))
+
+    def read(self) -> None:
+        try:
+            self.receive(os.read(self.fd, 1024))
+        except BlockingIOError:
+            pass
+
+    def send(self, data: bytes) -> None:
+        self.out.write(data)
+
+class MemoryTransport(Transport):
+    """
+    The MemoryTransport is for machines driven by another program, rather than
+    a person. Output is collected in `output`, and the input script is all
+    received up front, however long it is.
+    """
+    
+    def __init__(self, script: bytes = b"") -> None:
+        super().__init__()
+        # nothing else will ever arrive, so there's nothing to wait on (and no
+        # wake_fd)
+        self.received = deque()
+        self.receive(script)
+        self.output = bytearray()
+        
+    def describe(self) -> str:
+        return "memory"
+        
+    def send(self, data: bytes) -> None:
+        self.output += data
+
+def open_transport(spec: str) -> Transport:
+    """
+    Open a transport from a spec like:
+        - stdio
+        - none
+        - pty
+        - unix:<path>
+        - tcp:<port> (on localhost)
+        - file:<output path>[:<input path>]
+    """
+    import socket
+    kind, _, arg = spec.partition(":")
+
+    if kind == "stdio" and not arg: return get_stdio()
+    if kind == "none" and not arg: return NullTransport()
+    if kind == "pty" and not arg: return PtyTransport()
+    if kind == "unix" and arg: return SocketTransport(socket.AF_UNIX, arg)
+    if kind == "tcp" and arg.isdigit():
+        return SocketTransport(socket.AF_INET, ("127.0.0.1", int(arg)))
+    if kind == "file" and arg:
+        out_path, _, in_path = arg.partition(":")
+        return FileTransport(out_path, in_path or None)
+
+    raise ValueError(f"'{spec}' is not a serial transport")
@@ -1,27 +1,108 @@
+import re
 import sys
+import signal
 import os.path
 import argparse
 import traceback
-from time import sleep
 from typing import Iterator
 from sys import stderr, stdout
 
 from components.cpu import Cpu
-from components.ram import Ram
+from components.ram import Ram, ram_fill
 from components.rom import Rom
 from components.timer import Timer
 from components.serial import SerialPort
+from components.transports import open_transport, attach_terminal
+from components.clock import Clock, parse_clock
+from components.trace import Trace
 from components.block_devices import BootableDrive, NonBootableDrive, \
-    ExtendedRAM, BlockDeviceInterface
+    ExtendedRAM, CopyOnWriteDrive, BlockDeviceInterface
 from components.mm_component import MemoryMappedComponent
 
 device_types = {
     "boot": BootableDrive,
     "hdd": NonBootableDrive,
     "xmem": ExtendedRAM,
+    "cow": CopyOnWriteDrive,
 }
 
-def parse_args() -> argparse.Namespace:
+def clock_rate(text: str) -> int | None:
+    try:
+        return parse_clock(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def ram_fill_mode(text: str) -> str | int:
+    try:
+        return ram_fill(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def device_spec(text: str) -> tuple[int, str]:
+    # SLOT=TYPE:ARG -> (slot, TYPE:ARG)
+    slot, sep, literal = text.partition("=")
+    if not sep or not slot.strip().isdigit() or not 0 <= int(slot) <= 255:
+        raise argparse.ArgumentTypeError(
+            f"'{text}' should be SLOT=TYPE:ARG, with a slot from 0-255")
+    return int(slot), literal
+
+def port_spec(text: str) -> tuple[int, str]:
+    # NN=TRANSPORT -> (port, TRANSPORT), where NN is in hex
+    port, sep, transport = text.partition("=")
+    try:
+        number = int(port, 16)
+    except ValueError:
+        number = -1
+    if not sep or not 0x06 <= number <= 0xff:
+        raise argparse.ArgumentTypeError(
+            f"'{text}' should be PORT=TRANSPORT, with a port from 06-ff")
+    return number, transport
+
+# `-N TYPE:ARG` and `--slotN TYPE:ARG` install a device in slot N (as do
+# `-NTYPE:ARG`, `-N=TYPE:ARG` and `--slotN=TYPE:ARG`). rather than registering
+# 512 options, they are rewritten to `--device N=TYPE:ARG` first.
+SLOT_OPTION = re.compile(r"-(\d+)=?(.*)|--slot(\d+)(?:=(.*))?")
+
+def expand_slot_options(parser: argparse.ArgumentParser,
+                        argv: list[str]) -> list[str]:
+    # only options are rewritten, not other options' values (like
+    # `--disk-latency -5`), or anything after `--`
+    options = [o for a in parser._actions for o in a.option_strings]
+    value_options = {o for a in parser._actions if a.nargs != 0
+                     for o in a.option_strings}
+
+    def takes_value(arg: str) -> bool:
+        if arg in value_options: return True
+        if not arg.startswith("--") or "=" in arg: return False
+        # long options can be abbreviated
+        matches = [o for o in options if o.startswith(arg)]
+        return len(matches) == 1 and matches[0] in value_options
+
+    expanded = []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--":
+            expanded += [arg, *args]
+            break
+
+        match = SLOT_OPTION.fullmatch(arg)
+        slot = match and (match.group(1) or match.group(3))
+        if match is None or int(slot) > 255:
+            expanded.append(arg)
+            if takes_value(arg):
+                value = next(args, None)
+                if value is not None: expanded.append(value)
+            continue
+
+        literal = match.group(2) if match.group(1) else match.group(4)
+        if not literal:
+            literal = next(args, "")
+            if not literal or literal.startswith("-"):
+                parser.error(f"{arg} should be followed by TYPE:ARG")
+        expanded += ["--device", f"{slot}={literal}"]
+    return expanded
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         prog="ozpex-128",
         description = "A fictional 8-bit computer and emulator based on the "
@@ -32,19 +113,90 @@ def parse_args() -> argparse.Namespace:
                         default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "bin", "bios"),
                         help="overwrite the default bios rom")
     
-    for i in range(256):
-        parser.add_argument(
-            f'--slot{i}',
-            f'-{i}',
-            type=str,
-            default=None,
-            help=argparse.SUPPRESS,
-        )
+    parser.add_argument("-d", "--device",
+                        type=device_spec,
+                        action="append",
+                        default=[],
+                        metavar="SLOT=TYPE:ARG",
+                        help="insert a device into slot 0-255, e.g. "
+                             "0=boot:bin/testos (also written -0 boot:...)")
         
     parser.add_argument("-X", "--slotX",
                         help="insert a device into a virtual expansion slot")
 
     
+    parser.add_argument("--console",
+                        default="stdio",
+                        metavar="TRANSPORT",
+                        help="connect the console (serial port 00) to stdio, "
+                             "pty, unix:PATH, tcp:PORT, file:OUT[:IN] or none "
+                             "(default: stdio)")
+    
+    parser.add_argument("-p", "--port",
+                        type=port_spec,
+                        action="append",
+                        default=[],
+                        metavar="PORT=TRANSPORT",
+                        help="connect a misc serial port (06-ff, in hex) to "
+                             "a transport, e.g. 06=file:printer.txt")
+    
+    parser.add_argument("-c", "--clock",
+                        type=clock_rate,
+                        default="1MHz",
+                        help="the cpu's clock rate, e.g. 1MHz, 250kHz or "
+                             "unlimited (default: 1MHz)")
+    
+    parser.add_argument("--virtual-time",
+                        action="store_true",
+                        help="run the timer on cpu cycles at the clock rate "
+                             "(or 1MHz if unlimited) instead of real time")
+    
+    parser.add_argument("--disk-latency",
+                        type=int,
+                        default=0,
+                        metavar="CYCLES",
+                        help="how many cycles disks stay busy after changing "
+                             "sector (default: 0)")
+    
+    parser.add_argument("-r", "--ram",
+                        type=ram_fill_mode,
+                        default="random",
+                        help="what ram holds at power on: random, zero, or a "
+                             "number to seed the same random contents every "
+                             "time (default: random)")
+    
+    parser.add_argument("--commit-overlay",
+                        metavar="BASE:OVERLAY",
+                        help="copy the sectors in a cow overlay file into "
+                             "its base image and empty it, then exit")
+    
+    parser.add_argument("--discard-overlay",
+                        metavar="BASE:OVERLAY",
+                        help="empty a cow overlay file, then exit")
+    
+    parser.add_argument("--load-state",
+                        metavar="PATH",
+                        help="restore a snapshot of a machine with the same "
+                             "devices, instead of booting")
+    
+    parser.add_argument("--save-state",
+                        metavar="PATH",
+                        help="save a snapshot of the machine when the "
+                             "emulator exits")
+    
+    parser.add_argument("--trace",
+                        type=int,
+                        default=0,
+                        metavar="DEPTH",
+                        help="keep a trace of the last DEPTH instructions, "
+                             "saved if the emulator crashes, or on SIGUSR1 "
+                             "(read it with tracedump.py)")
+    
+    parser.add_argument("--trace-file",
+                        default="trace.bin",
+                        metavar="PATH",
+                        help="where to save the trace (default: trace.bin)")
+    
     parser.add_argument("--debug",
                         action="store_true",
                         help="watch the emulator execute individual instructions")
@@ -61,7 +213,8 @@ def parse_args() -> argparse.Namespace:
                         action="store_true",
                         help="start the ozpex 64 gui (ignores other arguments)")
     
-    return parser.parse_args()
+    if argv is None: argv = sys.argv[1:]
+    return parser.parse_args(expand_slot_options(parser, argv))
 
 def create_machine(args: argparse.Namespace) -> Cpu:
 
@@ -83,10 +236,18 @@ def create_machine(args: argparse.Namespace) -> Cpu:
     # $C200 - DFFF: UNDEFINED
     # $E000 - FFFF: BIOS ROM
     
+    # a transport or device that can't be set up raises ValueError or
+    # OSError, for the caller to report
+    serial_ports = {"serial": SerialPort(0xc000, open_transport(args.console))}
+    for port, transport in args.port:
+        serial_ports[f"port{port:02x}"] = SerialPort(
+            0xc000 + port, open_transport(transport), console=False)
+    
     cpu = Cpu({
-        "ram": Ram(0x0000, 0xbfff),
-        "serial": SerialPort(0xc000),
-        "timer": Timer(0xc001, 0xc002),
+        "ram": Ram(0x0000, 0xbfff, args.ram),
+        **serial_ports,
+        "timer": Timer(0xc001, 0xc002, virtual_hz=
+                       (args.clock or 1_000_000) if args.virtual_time else None),
         "blockdevs": BlockDeviceInterface(sector=0xc003, status=0xc005,
                                          selector=0xc004, readout=0xc100),
         "rom": Rom(0xe000, 0xffff),
@@ -96,29 +257,34 @@ def create_machine(args: argparse.Namespace) -> Cpu:
         bios_data = list(f.read())
     cpu.mm_components["rom"].load(bios_data, cpu.mm_components["rom"].start)
     
-    for i in range(256):
-        literal = getattr(args, f'slot{i}')
-        if literal is None: continue
+    for i, literal in args.device:
         device_type = literal.split(":")[0]
         device_arg = ":".join(literal.split(":")[1:])
+        if device_type not in device_types:
+            raise ValueError(f"'{device_type}' is not a supported device type")
         try:
-            cpu.mm_components["blockdevs"].devices[i] = device_types[device_type](device_arg)
-        except KeyError:
-            print("\n\n\033[31m", end="", file=stderr)
-            print(f"emu: '{device_type}' is not a supported device type.", file=stderr)
-            print("\033[0m", file=stderr)
-            exit(1)
+            cpu.mm_components["blockdevs"].devices[i] = \
+                device_types[device_type](device_arg,
+                                          busy_cycles=args.disk_latency)
+        except ValueError as e:
+            # a bad argument, like xmem's fill value
+            raise ValueError(f"{e} (in '{literal}')") from None
     
     cpu.reset()
     
     return cpu
 
-def simulate(cpu: Cpu, nocrash: bool, debug: bool) -> Iterator[None]:
-    cycles_executed = 0
-    
+def save_trace(cpu: Cpu, path: str) -> None:
+    if cpu.trace is None: return
+    cpu.trace.dump(path)
+    print(f"emu: the trace was saved to {path}", file=stderr)
+
+def simulate(cpu: Cpu, nocrash: bool, debug: bool, slice_cycles: int,
+             trace_file: str = "trace.bin") -> Iterator[None]:
     while True:
         try:
-            instr = cpu.execute()
+            if debug: instr = cpu.execute()
+            else: cpu.run_cycles(slice_cycles)
             yield
                        
         except NotImplementedError as e:    
@@ -126,12 +292,32 @@ def simulate(cpu: Cpu, nocrash: bool, debug: bool) -> Iterator[None]:
             print("\n\n\033[31m", end="", file=stderr)
             print(f"emu: {e}, execution aborted.", end="", file=stderr)
             print("\033[0m", file=stderr)
+            save_trace(cpu, trace_file)
             exit(1)
         if debug:
             cpu.visualise(instr)
             input()
 
+def open_overlay(spec: str) -> CopyOnWriteDrive:
+    # BASE:OVERLAY, where the overlay file already exists, since committing or
+    # discarding a new (empty) one would do nothing
+    if not spec.partition(":")[2]:
+        raise ValueError(f"'{spec}' should be BASE:OVERLAY")
+    return CopyOnWriteDrive(spec, create_overlay=False)
+
 def main(args: argparse.Namespace) -> None:
+    if args.commit_overlay or args.discard_overlay:
+        try:
+            if args.commit_overlay:
+                open_overlay(args.commit_overlay).commit()
+            else:
+                open_overlay(args.discard_overlay).discard()
+        except (ValueError, OSError) as e:
+            print(f"\033[31memu: cannot use the overlay: {e}.\033[0m",
+                  file=stderr)
+            exit(1)
+        return
+    
     if not os.path.exists(args.bios):
         print("\033[31memu: cannot find the bios rom.\033[0m", file=stderr)
         exit(1)
@@ -141,15 +327,47 @@ def main(args: argparse.Namespace) -> None:
         gui.main.App().mainloop()
         return
     
-    cpu = create_machine(args)
+    try:
+        cpu = create_machine(args)
+    except (ValueError, OSError) as e:
+        print(f"\033[31memu: {e}.\033[0m", file=stderr)
+        exit(1)
+    # say where any serial port not on the terminal can be found
+    for name, serial in cpu.mm_components.items():
+        if isinstance(serial, SerialPort) and \
+            (args.console != "stdio" or name != "serial"):
+            print(f"emu: {name} is on {serial.transport.describe()}",
+                  file=stderr)
+    if args.load_state:
+        try:
+            cpu.load_state(args.load_state)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"\033[31memu: cannot load the snapshot: {e}.\033[0m",
+                  file=stderr)
+            exit(1)
+    attach_terminal()
+    
+    if args.trace > 0:
+        cpu.set_trace(Trace(args.trace))
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1,
+                          lambda *_: save_trace(cpu, args.trace_file))
     
-    cycle = 0
-    for _ in simulate(cpu, args.nocrash, args.debug):
-        # on my computer, this gets ~1MHz
-        if cycle % 200 == 0:
-            cycle = 0
-            sleep(0.000001)
-        cycle += 1
+    clock = Clock(args.clock)
+    cpu.idle.hz = args.clock
+    clock.start(cpu.cycles)
+    serial_ports = [c for c in cpu.mm_components.values()
+                    if isinstance(c, SerialPort)]
+    try:
+        for _ in simulate(cpu, args.nocrash, args.debug, clock.slice_cycles,
+                          args.trace_file):
+            for serial in serial_ports: serial.tick()
+            if not args.debug: clock.throttle(cpu.cycles)
+    except Exception:
+        save_trace(cpu, args.trace_file)
+        raise
+    finally:
+        if args.save_state: cpu.save_state(args.save_state)
 
 if __name__ == "__main__":
     args = parse_args()
@@ -0,0 +1,157 @@
+import time
+import selectors
+
+from components.cpu import Cpu
+from components.idle import Parked
+from components.serial import SerialPort
+
+# many machines can share one process (and one core), by taking turns to run
+# a slice of cycles each. a machine that is waiting on its devices (e.g. for a
+# key, or for the timer to tick) is skipped until they could have changed, and
+# when every machine is waiting, the process sleeps until one of them could
+# carry on.
+
+class Machine:
+    """
+    A Machine is a cpu being run by a `Scheduler`, along with how it has been
+    getting on.
+
+    `stopped` is None while the machine is running, and says why it stopped
+    otherwise (like "crashed: ..."). `busy` is the time spent running it, so
+    `throughput` is how fast it runs while it has something to do.
+    """
+
+    def __init__(self, cpu: Cpu, name: str) -> None:
+        self.cpu = cpu
+        self.name = name
+        self.serial_ports = [c for c in cpu.mm_components.values()
+                             if isinstance(c, SerialPort)]
+
+        self.stopped: str | None = None
+        # when to run the machine again, and what could wake it up sooner
+        self.wake_at = 0.0
+        self.wake_fds: list[int] = []
+
+        self.added = time.perf_counter()
+        self.start_cycles = cpu.cycles
+        self.busy = 0.0 # seconds
+        self.slices = 0
+        self.parks = 0
+
+    def throughput(self) -> float:
+        # cycles per second of running time
+        if self.busy == 0: return 0.0
+        return (self.cpu.cycles - self.start_cycles) / self.busy
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "stopped": self.stopped,
+            "cycles": self.cpu.cycles - self.start_cycles,
+            "slices": self.slices,
+            "parks": self.parks,
+            "busy": self.busy,
+            "seconds": time.perf_counter() - self.added,
+            "hz": self.throughput(),
+        }
+
+class Scheduler:
+    """
+    The Scheduler runs machines round-robin, `slice_cycles` at a time, as fast
+    as they will go. Their idle loops are made cooperative (see
+    components/idle.py), so that a waiting machine hands its turn over rather
+    than sleeping.
+    """
+
+    def __init__(self, slice_cycles: int = 20_000) -> None:
+        self.slice_cycles = slice_cycles
+        self.machines: list[Machine] = []
+        # the wake fds of parked machines, each with the set of machines
+        # waiting on it (a console on stdio may be shared)
+        self.selector = selectors.DefaultSelector()
+
+    def add(self, cpu: Cpu, name: str | None = None) -> Machine:
+        cpu.idle.cooperative = True
+        machine = Machine(cpu, name or f"machine {len(self.machines)}")
+        self.machines.append(machine)
+        return machine
+
+    def remove(self, machine: Machine) -> None:
+        self.machines.remove(machine)
+        self.unpark(machine)
+        machine.cpu.idle.cooperative = False
+        machine.cpu.idle.waiting = None
+
+    def park(self, machine: Machine, fds: list[int]) -> None:
+        machine.wake_fds = fds
+        for fd in fds:
+            try:
+                self.selector.get_key(fd).data.add(machine)
+            except KeyError:
+                self.selector.register(fd, selectors.EVENT_READ, {machine})
+
+    def unpark(self, machine: Machine) -> None:
+        for fd in machine.wake_fds:
+            waiting = self.selector.get_key(fd).data
+            waiting.discard(machine)
+            if not waiting: self.selector.unregister(fd)
+        machine.wake_at = 0.0
+        machine.wake_fds = []
+
+    def run_slice(self, machine: Machine) -> None:
+        cpu = machine.cpu
+        cpu.idle.resume()
+
+        began = time.perf_counter()
+        try:
+            cpu.run_cycles(self.slice_cycles)
+        except Parked:
+            _, seconds, fds, _ = cpu.idle.waiting
+            machine.wake_at = time.perf_counter() + seconds
+            self.park(machine, fds)
+            machine.parks += 1
+        except (NotImplementedError, IndexError) as e:
+            machine.stopped = f"crashed: {e}"
+        machine.busy += time.perf_counter() - began
+        machine.slices += 1
+
+        for serial in machine.serial_ports: serial.tick()
+
+    def step(self) -> bool:
+        # give every machine that isn't waiting a turn, or if they all are,
+        # sleep until one of them could carry on. returns False once every
+        # machine has stopped.
+        running = [m for m in self.machines if m.stopped is None]
+        if not running: return False
+
+        # machines waiting on a file descriptor may be ready early
+        ready = set()
+        if self.selector.get_map():
+            for key, _ in self.selector.select(0): ready.update(key.data)
+
+        now = time.perf_counter()
+        ran = False
+        for machine in running:
+            if machine.wake_at > now and machine not in ready: continue
+            self.unpark(machine)
+            self.run_slice(machine)
+            ran = True
+
+        if not ran:
+            timeout = max(0.0, min(m.wake_at for m in running) - now)
+            if self.selector.get_map():
+                self.selector.select(timeout)
+            else:
+                time.sleep(timeout)
+        return True
+
+    def run(self, seconds: float | None = None) -> None:
+        # run until every machine has stopped, or for this many seconds
+        end = None if seconds is None else time.perf_counter() + seconds
+        while self.step():
+            if end is not None and time.perf_counter() >= end: break
+        for machine in self.machines:
+            for serial in machine.serial_ports: serial.flush()
+
+    def stats(self) -> list[dict]:
+        return [machine.stats() for machine in self.machines]
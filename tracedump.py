@@ -0,0 +1,66 @@
+import sys
+import argparse
+
+from components.cpu import Isa
+from components.trace import read_trace
+
+# how each addressing mode's effective address (or operand) is shown
+OPERANDS = {
+    None: "",
+    "addr_accumulator": "a",
+    "addr_immediate": "#${:02x}",
+    "addr_relative": "${:04x}",
+    "addr_zero_page": "${:04x}",
+    "addr_zero_page_x": "${:04x} (zp,x)",
+    "addr_zero_page_y": "${:04x} (zp,y)",
+    "addr_absolute": "${:04x}",
+    "addr_absolute_x": "${:04x} (abs,x)",
+    "addr_absolute_y": "${:04x} (abs,y)",
+    "addr_indexed_indirect": "${:04x} (ind,x)",
+    "addr_indirect_indexed": "${:04x} (ind),y",
+    "addr_indirect": "${:04x} (ind)",
+}
+
+def flags(status: int) -> str:
+    return "".join(name if status & (0x80 >> i) else name.lower()
+                   for i, name in enumerate("NV-BDIZC"))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="print the instructions in an ozpex 128 trace file",
+    )
+    parser.add_argument("trace", help="a trace file saved by the emulator")
+    parser.add_argument("-n", "--last",
+                        type=int,
+                        help="only print the last N instructions")
+    args = parser.parse_args()
+    if args.last is not None and args.last < 0:
+        parser.error("--last can't be negative")
+
+    try:
+        count, records = read_trace(args.trace)
+    except (OSError, ValueError) as e:
+        print(f"\033[31memu: cannot read the trace: {e}.\033[0m",
+              file=sys.stderr)
+        exit(1)
+    records = list(records)
+    if args.last is not None:
+        records = records[max(0, len(records) - args.last):]
+
+    # isa methods are only looked at, never called
+    opcodes = Isa(None).opcodes
+    first = count - len(records)
+    for i, (pc, opcode, ra, rx, ry, sp, status, addr) in \
+        enumerate(records, first + 1):
+        if opcode in opcodes:
+            instr, mode, _, _ = opcodes[opcode]
+            mode = None if mode is None else mode.__name__
+            text = f"{instr.__name__.rstrip('_')} " + \
+                OPERANDS[mode].format(addr)
+        else:
+            text = "???"
+        print(f"{i:>10} ${pc:04x}  {opcode:02x}  {text:24} "
+              f"a={ra:02x} x={rx:02x} y={ry:02x} sp={sp:02x} {flags(status)}")
+
+if __name__ == "__main__":
+    main()